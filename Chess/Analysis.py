@@ -0,0 +1,59 @@
+import argparse
+import sys
+from Chess import ChessEngine, SmartMoveFinder, Uci
+
+
+def analysePosition(fen, timeLimit=None, depth=None, workers=1, progress=None):
+    """
+    Search the position given as FEN without the GUI
+    :param fen:
+    :param timeLimit: seconds
+    :param depth:
+    :param workers:
+    :param progress: called with the SearchStats after every finished depth
+    :return: the best Move, or None when the side to move is checkmated or stalemated, and the SearchStats
+    """
+    gs = ChessEngine.GameState.fromFEN(fen)
+    validMoves = gs.getValidMoves()
+    return SmartMoveFinder.findBestMoveWithStats(gs, validMoves, timeLimit=timeLimit, maxDepth=depth, workers=workers,
+                                                 progress=progress)
+
+
+def printDepth(stats):
+    """
+    Progress callback printing one line per finished depth
+    :param stats:
+    :return:
+    """
+    record = stats.depths[-1]
+    print("depth %d seldepth %d score %s nodes %d time %.3f pv %s" % (record["depth"], record["seldepth"],
+                                                                      Uci.formatScore(record["score"]),
+                                                                      record["nodes"], record["time"],
+                                                                      " ".join(record["pv"])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search a FEN position and print the best move")
+    parser.add_argument("fen")
+    parser.add_argument("--time", type=float, help="seconds to search")
+    parser.add_argument("--depth", type=int, help="deepest iteration, defaults to SmartMoveFinder.DEPTH without "
+                                                  "--time")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--stats", action="store_true", help="print every finished depth and the search counters")
+    args = parser.parse_args(argv)
+    try:
+        move, stats = analysePosition(args.fen, args.time, args.depth, args.workers,
+                                      printDepth if args.stats else None)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if args.stats:
+        print("nodes %d qnodes %d nps %.0f first move cutoffs %.1f%% tt hits %.1f%% tablebase hits %d" % (
+            stats.nodes, stats.qnodes, stats.nps(), 100 * stats.firstMoveCutoffRate(), 100 * stats.ttHitRate(),
+            stats.tbHits))
+    print(move.getChessNotation() if move is not None else "(none)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
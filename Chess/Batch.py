@@ -0,0 +1,178 @@
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import sys
+from Chess import ChessEngine, SmartMoveFinder
+
+TASKS_PER_WORKER = 4  # positions queued per worker process, enough to keep them busy without reading ahead far
+batchEngine = None  # the engine of this process, created on its first position
+
+
+def readPositions(lines):
+    """
+    Turn FEN or EPD lines into positions, lazily, so a file of any size streams through. Blank lines and lines
+    starting with # are skipped
+    :param lines: iterable of text lines
+    :return: generator of (index, fen, EPD operations) with the index counting positions from 0
+    """
+    index = 0
+    for line in lines:
+        line = line.strip()
+        if len(line) == 0 or line.startswith("#"):
+            continue
+        fields = line.split()
+        if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit():  # FEN with move counters
+            fen = " ".join(fields[:6])
+            operations = {}
+        else:  # EPD: the first four FEN fields followed by "opcode operand;" operations
+            fen = " ".join(fields[:4])
+            operations = parseOperations(line.split(None, 4)[4] if len(fields) > 4 else "")
+        yield index, fen, operations
+        index += 1
+
+
+def parseOperations(text):
+    """
+    The operations of an EPD record, e.g. 'bm Qxf7+; id "puzzle 1";'
+    :param text:
+    :return: dict from opcode to its operands, with surrounding quotes removed
+    """
+    operations = {}
+    for operation in text.split(";"):
+        parts = operation.strip().split(None, 1)
+        if len(parts) > 0:
+            operations[parts[0]] = parts[1].strip().strip('"') if len(parts) > 1 else ""
+    return operations
+
+
+def analyseFen(fen, limits):
+    """
+    Search one position with the engine of this process. Runs in the pool's worker processes
+    :param fen:
+    :param limits: SearchLimits
+    :return: dict with the best move, score in centipawns from the side to move's point of view, mate in moves as
+    SmartMoveFinder.mateMoves gives it or None, depth reached, nodes and seconds, or with the error when the FEN does
+    not parse
+    """
+    global batchEngine
+    if batchEngine is None:
+        batchEngine = SmartMoveFinder.SearchEngine()
+    try:
+        gs = ChessEngine.GameState.fromFEN(fen)
+    except ValueError as e:
+        return {"error": str(e)}
+    move, stats = batchEngine.search(gs, limits)
+    if move is None:  # checkmate or stalemate, there is nothing to search
+        gs.getValidMoves()
+        score = -SmartMoveFinder.CHECKMATE if gs.checkMate else SmartMoveFinder.STALEMATE
+        return {"move": None, "score": score, "mate": SmartMoveFinder.mateMoves(score), "depth": 0, "nodes": 0,
+                "time": 0.0}
+    record = stats.depths[-1]
+    return {"move": move.getChessNotation(), "score": record["score"],
+            "mate": SmartMoveFinder.mateMoves(record["score"]), "depth": record["depth"],
+            "nodes": stats.nodes + stats.qnodes, "time": round(stats.elapsed, 3), "pv": record["pv"]}
+
+
+def analyseBatch(positions, out, limits, workers=1):
+    """
+    Search every position and write one JSON line per position to out, in input order, flushing after each line so
+    the output file always holds a prefix of the results and can be resumed from. With workers > 1 the positions are
+    spread over a process pool, keeping only a few of them in flight per worker
+    :param positions: iterable of (index, fen, EPD operations) as readPositions gives them
+    :param out: text stream
+    :param limits: SearchLimits for each position, its workers are ignored
+    :param workers:
+    :return: number of positions written
+    """
+    written = 0
+
+    def write(index, fen, operations, result):
+        nonlocal written
+        record = {"index": index, "fen": fen}
+        if "id" in operations:
+            record["id"] = operations["id"]
+        record.update(result)
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+        written += 1
+
+    if workers <= 1:
+        for index, fen, operations in positions:
+            write(index, fen, operations, analyseFen(fen, limits))
+        return written
+    pending = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        for index, fen, operations in positions:
+            pending.append((index, fen, operations, pool.submit(analyseFen, fen, limits)))
+            if len(pending) >= workers * TASKS_PER_WORKER:
+                index, fen, operations, future = pending.popleft()
+                write(index, fen, operations, future.result())
+        while len(pending) > 0:
+            index, fen, operations, future = pending.popleft()
+            write(index, fen, operations, future.result())
+    return written
+
+
+def resumeOutput(path):
+    """
+    Open the output of an interrupted run for appending. A last line cut off mid-write is dropped, as that position
+    will be searched again
+    :param path:
+    :return: (stream opened for appending, number of positions already done)
+    """
+    if not os.path.exists(path):
+        return open(path, "w"), 0
+    done = 0
+    keep = 0  # bytes up to the end of the last complete line
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            done += 1
+            keep += len(line)
+    out = open(path, "r+")
+    out.truncate(keep)
+    out.seek(keep)
+    return out, done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search every FEN or EPD position of a file and write the results "
+                                                 "as JSON lines")
+    parser.add_argument("input", help="one FEN or EPD position per line, - for stdin")
+    parser.add_argument("-o", "--output", help="JSONL file, stdout when left out")
+    parser.add_argument("--time", type=float, help="seconds per position")
+    parser.add_argument("--nodes", type=int, help="nodes per position")
+    parser.add_argument("--depth", type=int, help="deepest iteration, defaults to SmartMoveFinder.DEPTH without "
+                                                  "--time or --nodes")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes, defaults to the CPU "
+                                                                                 "count")
+    parser.add_argument("--resume", action="store_true", help="skip the positions already in --output and append "
+                                                              "the rest")
+    args = parser.parse_args(argv)
+    if args.resume and args.output is None:
+        parser.error("--resume needs --output")
+    limits = SmartMoveFinder.SearchLimits(args.time, args.nodes, args.depth)
+    inputFile = sys.stdin if args.input == "-" else open(args.input)
+    if args.output is None:
+        out, done = sys.stdout, 0
+    elif args.resume:
+        out, done = resumeOutput(args.output)
+    else:
+        out, done = open(args.output, "w"), 0
+    try:
+        positions = (position for position in readPositions(inputFile) if position[0] >= done)
+        written = analyseBatch(positions, out, limits, args.workers)
+    finally:
+        if inputFile is not sys.stdin:
+            inputFile.close()
+        if out is not sys.stdout:
+            out.close()
+    print("%d positions analysed, %d skipped as already done" % (written, done), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
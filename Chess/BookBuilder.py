@@ -0,0 +1,173 @@
+import argparse
+import re
+import sys
+from Chess import ChessEngine, OpeningBook
+
+DEFAULT_PLIES = 20  # moves deeper into the game than this are not booked
+RESULT_TOKENS = ("1-0", "0-1", "1/2-1/2", "*")
+# comments, variation brackets, NAGs, move numbers and everything else as a move or result
+TOKEN_PATTERN = re.compile(r"\{[^}]*\}|;[^\n]*|\(|\)|\$\d+|\d+\.+|[^\s(){};]+")
+
+
+def readGames(lines):
+    """
+    Split PGN text into games, lazily
+    :param lines: iterable of text lines
+    :return: generator of (headers dict, moves in SAN) for the main line of every game
+    """
+    headers = {}
+    moveText = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith("["):
+            if len(moveText) > 0:  # the header of the next game
+                yield headers, parseMoveText(" ".join(moveText))
+                headers = {}
+                moveText = []
+            match = re.match(r'\[(\w+)\s+"(.*)"\]', line)
+            if match:
+                headers[match.group(1)] = match.group(2)
+        elif len(line) > 0:
+            moveText.append(line)
+    if len(moveText) > 0 or len(headers) > 0:
+        yield headers, parseMoveText(" ".join(moveText))
+
+
+def readFiles(paths):
+    """
+    The games of several PGN files one after the other, each file opened only when its turn comes
+    :param paths: file names, - for stdin
+    :return: generator of (headers dict, moves in SAN)
+    """
+    for path in paths:
+        if path == "-":
+            yield from readGames(sys.stdin)
+        else:
+            with open(path) as f:
+                yield from readGames(f)
+
+
+def parseMoveText(text):
+    """
+    The main line moves of a game's move text, skipping comments, variations, NAGs, move numbers and the result
+    :param text:
+    :return: moves in SAN
+    """
+    moves = []
+    variationDepth = 0
+    for match in TOKEN_PATTERN.finditer(text):
+        token = match.group(0)
+        if token == "(":
+            variationDepth += 1
+        elif token == ")":
+            variationDepth -= 1
+        elif variationDepth > 0 or token[0] in "{;$" or token[0].isdigit() and token.endswith("."):
+            continue
+        elif token in RESULT_TOKENS:
+            break
+        else:
+            moves.append(token)
+    return moves
+
+
+def findSanMove(gs, san, validMoves=None):
+    """
+    The legal move of gs written in standard algebraic notation, e.g. Nf3, exd5, O-O or e8=Q+
+    :param gs:
+    :param san:
+    :param validMoves: the legal moves of gs, generated when left out
+    :return: the Move, or None when no legal move or more than one fits
+    """
+    if validMoves is None:
+        validMoves = gs.getValidMoves()
+    san = san.rstrip("+#!?")
+    if san in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        endCol = 6 if len(san) == 3 else 2
+        matches = [move for move in validMoves if move.isCastleMove and move.endCol == endCol]
+        return matches[0] if len(matches) == 1 else None
+    promotion = None
+    if "=" in san:
+        san, promotion = san.split("=", 1)
+    elif len(san) > 2 and san[-1] in "QRBN" and san[-2].isdigit():  # promotion written without =, e.g. e8Q
+        san, promotion = san[:-1], san[-1]
+    piece = san[0] if len(san) > 0 and san[0] in "KQRBN" else "p"
+    body = (san[1:] if piece != "p" else san).replace("x", "").replace(":", "")
+    if len(body) < 2:
+        return None
+    target = body[-2:]
+    disambiguation = body[:-2]
+    matches = []
+    for move in validMoves:
+        if move.pieceMoved[1] != piece or move.getRankFile(move.endRow, move.endCol) != target:
+            continue
+        if move.promotionPiece != promotion:
+            continue
+        origin = move.getRankFile(move.startRow, move.startCol)
+        if all(char in origin for char in disambiguation):
+            matches.append(move)
+    return matches[0] if len(matches) == 1 else None
+
+
+def resultWeights(result):
+    """
+    Weight a game adds to the moves of each side: 2 for the winner, 1 each for a draw or an unknown result and 0 for
+    the loser, so the book prefers moves that scored well
+    :param result:
+    :return: (weight for white's moves, weight for black's moves)
+    """
+    if result == "1-0":
+        return 2, 0
+    if result == "0-1":
+        return 0, 2
+    return 1, 1
+
+
+def buildBook(games, plies=DEFAULT_PLIES, minGames=1):
+    """
+    Count the moves played in every position of the first plies of the games
+    :param games: iterable of (headers, SAN moves) as readGames gives them
+    :param plies:
+    :param minGames: moves played in fewer games are left out
+    :return: (dict from (key, move code) to weight, number of games read, number of games with an illegal move)
+    """
+    weights = {}
+    played = {}
+    gameCount = 0
+    badGames = 0
+    for headers, moves in games:
+        gameCount += 1
+        try:
+            gs = ChessEngine.GameState.fromFEN(headers["FEN"]) if "FEN" in headers else ChessEngine.GameState()
+        except ValueError:
+            badGames += 1
+            continue
+        whiteWeight, blackWeight = resultWeights(headers.get("Result", "*"))
+        for san in moves[:plies]:
+            move = findSanMove(gs, san)
+            if move is None:  # the rest of the game cannot be followed
+                badGames += 1
+                break
+            entry = (gs.zobristKey, move.code)
+            weights[entry] = weights.get(entry, 0) + (whiteWeight if gs.whiteToMove else blackWeight)
+            played[entry] = played.get(entry, 0) + 1
+            gs.makeMove(move)
+    book = {entry: weight for entry, weight in weights.items() if weight > 0 and played[entry] >= minGames}
+    return book, gameCount, badGames
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build an opening book from PGN games")
+    parser.add_argument("pgn", nargs="+", help="PGN files, - for stdin")
+    parser.add_argument("-o", "--output", default=OpeningBook.DEFAULT_BOOK)
+    parser.add_argument("--plies", type=int, default=DEFAULT_PLIES, help="half moves of every game to book")
+    parser.add_argument("--min-games", type=int, default=1, help="leave out moves played in fewer games")
+    args = parser.parse_args(argv)
+    book, gameCount, badGames = buildBook(readFiles(args.pgn), args.plies, args.min_games)
+    written = OpeningBook.writeBook(book, args.output)
+    print("%d games read, %d stopped at an illegal move, %d book entries written to %s" % (
+        gameCount, badGames, written, args.output), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
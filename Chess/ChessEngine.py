@@ -1,3 +1,157 @@
+import random
+from Chess import PieceSquareTables
+
+# Squares are indexed 0..63 as row * 8 + col, so bit 0 is a8 and bit 63 is h1, matching board[row][col].
+ORTHOGONAL = ((-1, 0), (0, -1), (1, 0), (0, 1))
+DIAGONAL = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_JUMPS = ((-2, -1), (-2, 1), (2, -1), (2, 1), (1, -2), (1, 2), (-1, -2), (-1, 2))
+KING_STEPS = ORTHOGONAL + DIAGONAL
+PIECES = ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+FEN_TO_PIECE = {'p': 'p', 'n': 'N', 'b': 'B', 'r': 'R', 'q': 'Q', 'k': 'K'}
+PIECE_TO_FEN = {v: k for k, v in FEN_TO_PIECE.items()}
+pieceScore = {"K": 0, "Q": 10, "R": 5, "N": 3, "B": 3, "p": 1}
+# material of each piece from white's point of view
+MATERIAL = {piece: pieceScore[piece[1]] if piece[0] == 'w' else -pieceScore[piece[1]] for piece in PIECES}
+MG_SCORES = PieceSquareTables.MG_SCORES
+EG_SCORES = PieceSquareTables.EG_SCORES
+PHASE = PieceSquareTables.PHASE
+# Moves are packed into ints: bits 0-5 start square, 6-11 end square, 12-13 flag, 14-15 promotion piece
+NORMAL_MOVE = 0
+PROMOTION_MOVE = 1
+ENPASSANT_MOVE = 2
+CASTLE_MOVE = 3
+PROMOTION_PIECES = ("Q", "R", "B", "N")
+# move log records add the moved piece at bit 16 and the captured piece at bit 20, 12 standing for an empty square
+SQUARE_PIECES = PIECES + ('--',)
+PIECE_INDEX = {piece: i for i, piece in enumerate(SQUARE_PIECES)}
+# kinds of moves a generator is asked for, so the search can take captures first and quiet moves only when needed
+ALL_MOVES = 0
+CAPTURE_MOVES = 1  # captures and promotions
+QUIET_MOVES = 2  # everything else, castling included
+ALL_SQUARES = (1 << 64) - 1
+
+
+def encodeMove(startSq, endSq, flag=NORMAL_MOVE, promotionPiece="Q"):
+    """
+    Pack a move into a single int
+    :param startSq: row * 8 + col
+    :param endSq: row * 8 + col
+    :param flag: NORMAL_MOVE, PROMOTION_MOVE, ENPASSANT_MOVE or CASTLE_MOVE
+    :param promotionPiece: only used with PROMOTION_MOVE
+    :return:
+    """
+    code = startSq | endSq << 6 | flag << 12
+    if flag == PROMOTION_MOVE:
+        code |= PROMOTION_PIECES.index(promotionPiece) << 14
+    return code
+
+
+def moveFromRecord(record):
+    """
+    The full Move object of a packed move record, which holds the move code and the moved and captured pieces
+    :param record: entry of GameState.moveRecords
+    :return:
+    """
+    return Move.fromCode(record & 0xFFFF, SQUARE_PIECES[record >> 16 & 15], SQUARE_PIECES[record >> 20 & 15])
+
+
+def buildRayTable():
+    """
+    For every direction and square, the bitboard of all squares reached by sliding from that square to the edge
+    :return: dict direction -> list of 64 bitboards
+    """
+    rays = {}
+    for d in KING_STEPS:
+        table = []
+        for sq in range(64):
+            mask = 0
+            row, col = sq // 8 + d[0], sq % 8 + d[1]
+            while 0 <= row < 8 and 0 <= col < 8:
+                mask |= 1 << (row * 8 + col)
+                row += d[0]
+                col += d[1]
+            table.append(mask)
+        rays[d] = table
+    return rays
+
+
+def buildLeaperTable(steps):
+    """
+    For every square, the bitboard of squares a knight or king standing there can jump to
+    :param steps:
+    :return: list of 64 bitboards
+    """
+    table = []
+    for sq in range(64):
+        mask = 0
+        for d in steps:
+            row, col = sq // 8 + d[0], sq % 8 + d[1]
+            if 0 <= row < 8 and 0 <= col < 8:
+                mask |= 1 << (row * 8 + col)
+        table.append(mask)
+    return table
+
+
+FORWARD = frozenset(d for d in KING_STEPS if d[0] * 8 + d[1] > 0)
+FILE_A = sum(1 << (row * 8) for row in range(8))
+FILE_H = FILE_A << 7
+ROWS = [0xFF << (row * 8) for row in range(8)]
+PROMOTION_ROWS = ROWS[0] | ROWS[7]
+SLIDER_DIRECTIONS = {'B': DIAGONAL, 'R': ORTHOGONAL, 'Q': KING_STEPS}
+RAYS = buildRayTable()
+KNIGHT_TABLE = buildLeaperTable(KNIGHT_JUMPS)
+KING_TABLE = buildLeaperTable(KING_STEPS)
+# squares a pawn of each color standing on a square attacks, white pawns capture towards row 0
+PAWN_ATTACKS = {'w': buildLeaperTable(((-1, -1), (-1, 1))), 'b': buildLeaperTable(((1, -1), (1, 1)))}
+# every square a rook or bishop on a square could reach on an empty board, to skip slider scans with nothing in line
+ORTHOGONAL_LINES = [sum(RAYS[d][sq] for d in ORTHOGONAL) for sq in range(64)]
+DIAGONAL_LINES = [sum(RAYS[d][sq] for d in DIAGONAL) for sq in range(64)]
+
+# Zobrist keys: a fixed seed keeps hashes identical between runs and processes
+zobristRandom = random.Random(0x5EED)
+ZOBRIST_PIECES = {piece: [zobristRandom.getrandbits(64) for sq in range(64)] for piece in PIECES}
+ZOBRIST_BLACK_TO_MOVE = zobristRandom.getrandbits(64)
+ZOBRIST_CASTLING = [zobristRandom.getrandbits(64) for rights in range(16)]
+ZOBRIST_ENPASSANT = [zobristRandom.getrandbits(64) for col in range(8)]
+
+
+def firstBlocker(d, sq, occupied):
+    """
+    The first occupied square met when sliding from sq in direction d, or -1 if the ray is empty
+    :param d:
+    :param sq:
+    :param occupied:
+    :return:
+    """
+    blockers = RAYS[d][sq] & occupied
+    if not blockers:
+        return -1
+    if d in FORWARD:  # ray runs towards higher squares, so the nearest blocker is the lowest bit
+        return (blockers & -blockers).bit_length() - 1
+    return blockers.bit_length() - 1
+
+
+def slidingAttacks(sq, occupied, directions):
+    """
+    Bitboard of the squares a slider on sq attacks along directions, up to and including the first blocker
+    :param sq:
+    :param occupied:
+    :param directions:
+    :return:
+    """
+    attacks = 0
+    for d in directions:
+        ray = RAYS[d][sq]
+        blockers = ray & occupied
+        if blockers:
+            if d in FORWARD:
+                ray ^= RAYS[d][(blockers & -blockers).bit_length() - 1]
+            else:
+                ray ^= RAYS[d][blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+
 class GameState:
 
     def __init__(self):
@@ -10,70 +164,291 @@ class GameState:
                       ['wp', 'wp', 'wp', 'wp', 'wp', 'wp', 'wp', 'wp'],
                       ['wR', 'wN', 'wB', 'wQ', 'wK', 'wB', 'wN', 'wR']]
 
-        self.moveFunctions = {'p': self.getPawnMoves, 'R': self.getRookMoves, 'K': self.getKingMoves,
-                              'Q': self.getQueenMoves, 'N': self.getKnightMoves, 'B': self.getBishopMoves}
         self.whiteToMove = True
         self.whiteKingLocation = (7, 4)
         self.blackKingLocation = (0, 4)
         self.checkMate = False
         self.staleMate = False
         self.enpassantPossible = ()
-        self.moveLog = []
+        self.enpassantPossibleLog = [self.enpassantPossible]
+        self.halfmoveClock = 0  # moves since the last capture or pawn move, for the fifty-move rule
+        self.halfmoveClockLog = [self.halfmoveClock]
+        self.fullmoveNumber = 1  # starts at 1 and goes up after every black move
+        self.moveRecords = []  # packed move code plus the moved and captured piece of every move played
         # self.redoMoveLog = []
         self.inCheck = False
-        self.pins = []
+        self.pins = {}
         self.checks = []
+        self.checkMask = ALL_SQUARES  # squares pieces other than the king may move to, narrowed when in check
         self.currentCastlingRight = CastleRights(True, True, True, True)
         self.castleRightsLog = [
             CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.wqs, self.currentCastlingRight.bks,
                          self.currentCastlingRight.bqs)]
+        # bitboards: one 64-bit integer per piece, plus occupancy per color and for the whole board
+        self.bitboards = {}
+        self.occupancy = {}
+        self.occupied = 0
+        # 64-bit Zobrist hash of the position, kept up to date by makeMove/undoMove
+        self.zobristKey = 0
+        # material balance, positive is good for white, kept up to date by makeMove/undoMove
+        self.materialScore = 0
+        # Zobrist hash of the pawns alone, the key of the evaluation's pawn structure cache
+        self.pawnKey = 0
+        # piece-square totals in centipawns for the middlegame and the endgame, positive is good for white, and the
+        # game phase the evaluation blends them by, see PieceSquareTables
+        self.mgScore = 0
+        self.egScore = 0
+        self.phase = 0
+        self.loadBitboards()
+
+    @classmethod
+    def fromFEN(cls, fen):
+        """
+        Build a GameState from a FEN string. The move counters are optional and default to 0 and 1. Castling rights
+        whose king or rook is not on its starting square are dropped
+        :param fen:
+        :return:
+        :raises ValueError: when the FEN is malformed or the position cannot arise in a game: not one king per side, a
+        pawn on the first or last rank, an en passant square no pawn just skipped, or the side not to move in check
+        """
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError("FEN needs at least 4 fields: " + fen)
+        gs = cls()
+        gs.board = []
+        for rank in fields[0].split('/'):
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend(['--'] * int(char))
+                elif char.lower() in FEN_TO_PIECE:
+                    row.append(('w' if char.isupper() else 'b') + FEN_TO_PIECE[char.lower()])
+                else:
+                    raise ValueError("Bad piece '" + char + "' in FEN: " + fen)
+            if len(row) != 8:
+                raise ValueError("Rank '" + rank + "' does not have 8 squares in FEN: " + fen)
+            gs.board.append(row)
+        if len(gs.board) != 8:
+            raise ValueError("FEN board does not have 8 ranks: " + fen)
+        for color in 'wb':
+            kings = [(r, c) for r in range(8) for c in range(8) if gs.board[r][c] == color + 'K']
+            if len(kings) != 1:
+                raise ValueError("FEN must have exactly one %s king: %s" % ('white' if color == 'w' else 'black', fen))
+            if color == 'w':
+                gs.whiteKingLocation = kings[0]
+            else:
+                gs.blackKingLocation = kings[0]
+        if 'wp' in gs.board[0] + gs.board[7] or 'bp' in gs.board[0] + gs.board[7]:
+            raise ValueError("Pawn on the first or last rank in FEN: " + fen)
+        if fields[1] not in ('w', 'b'):
+            raise ValueError("Side to move must be w or b in FEN: " + fen)
+        gs.whiteToMove = fields[1] == 'w'
+        castling = fields[2]
+        if castling != '-' and (len(castling) == 0 or any(char not in 'KQkq' or castling.count(char) > 1
+                                                          for char in castling)):
+            raise ValueError("Bad castling field '" + castling + "' in FEN: " + fen)
+        board = gs.board
+        # a right needs its king and rook still on their starting squares
+        wks = 'K' in castling and board[7][4] == 'wK' and board[7][7] == 'wR'
+        wqs = 'Q' in castling and board[7][4] == 'wK' and board[7][0] == 'wR'
+        bks = 'k' in castling and board[0][4] == 'bK' and board[0][7] == 'bR'
+        bqs = 'q' in castling and board[0][4] == 'bK' and board[0][0] == 'bR'
+        gs.currentCastlingRight = CastleRights(wks, wqs, bks, bqs)
+        gs.castleRightsLog = [CastleRights(wks, wqs, bks, bqs)]
+        if fields[3] != '-':
+            square = fields[3]
+            # the pawn that just moved two squares stands in front of the square it skipped, which is empty like the
+            # square it came from
+            if len(square) != 2 or square[0] not in Move.filesToCols or square[1] != ('6' if gs.whiteToMove else '3'):
+                raise ValueError("Bad en passant square '" + square + "' in FEN: " + fen)
+            row, col = Move.ranksToRows[square[1]], Move.filesToCols[square[0]]
+            direction = 1 if gs.whiteToMove else -1
+            if board[row + direction][col] != ('b' if gs.whiteToMove else 'w') + 'p' or board[row][col] != '--' or \
+                    board[row - direction][col] != '--':
+                raise ValueError("No pawn can just have skipped the en passant square '" + square + "' in FEN: " +
+                                 fen)
+            gs.enpassantPossible = (row, col)
+        gs.enpassantPossibleLog = [gs.enpassantPossible]
+        if len(fields) > 4:
+            gs.halfmoveClock = int(fields[4])
+            gs.halfmoveClockLog = [gs.halfmoveClock]
+        if len(fields) > 5:
+            gs.fullmoveNumber = int(fields[5])
+        gs.loadBitboards()
+        king = gs.blackKingLocation if gs.whiteToMove else gs.whiteKingLocation
+        if gs.attackersTo(king[0] * 8 + king[1], 'w' if gs.whiteToMove else 'b'):
+            raise ValueError("The side not to move is in check in FEN: " + fen)
+        return gs
+
+    def toFEN(self):
+        """
+        The position as a FEN string
+        :return:
+        """
+        ranks = []
+        for row in self.board:
+            rank = ''
+            empty = 0
+            for square in row:
+                if square == '--':
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += PIECE_TO_FEN[square[1]].upper() if square[0] == 'w' else PIECE_TO_FEN[square[1]]
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        rights = self.currentCastlingRight
+        castling = ('K' if rights.wks else '') + ('Q' if rights.wqs else '') + ('k' if rights.bks else '') + \
+                   ('q' if rights.bqs else '')
+        if self.enpassantPossible != ():
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+        else:
+            enpassant = '-'
+        return ' '.join(('/'.join(ranks), 'w' if self.whiteToMove else 'b', castling or '-', enpassant,
+                         str(self.halfmoveClock), str(self.fullmoveNumber)))
+
+    def loadBitboards(self):
+        """
+        Rebuild every bitboard, the Zobrist keys, the material balance and the piece-square totals from self.board and
+        the state flags
+        :return:
+        """
+        self.bitboards = {piece: 0 for piece in PIECES}
+        self.occupancy = {'w': 0, 'b': 0}
+        self.occupied = 0
+        self.zobristKey = 0
+        self.materialScore = 0
+        self.pawnKey = 0
+        self.mgScore = 0
+        self.egScore = 0
+        self.phase = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != '--':
+                    self.togglePiece(piece, r * 8 + c)
+        if not self.whiteToMove:
+            self.zobristKey ^= ZOBRIST_BLACK_TO_MOVE
+        self.zobristKey ^= ZOBRIST_CASTLING[self.currentCastlingRight.toIndex()]
+        if self.enpassantPossible != ():
+            self.zobristKey ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+
+    def togglePiece(self, piece, sq):
+        """
+        Adds piece on sq to the bitboards if it is not there, removes it otherwise. The board is not touched
+        :param piece:
+        :param sq:
+        :return:
+        """
+        bit = 1 << sq
+        self.bitboards[piece] ^= bit
+        self.occupancy[piece[0]] ^= bit
+        self.occupied ^= bit
+        self.zobristKey ^= ZOBRIST_PIECES[piece][sq]
+        if piece[1] == 'p':
+            self.pawnKey ^= ZOBRIST_PIECES[piece][sq]
+        if self.bitboards[piece] & bit:
+            self.materialScore += MATERIAL[piece]
+            self.mgScore += MG_SCORES[piece][sq]
+            self.egScore += EG_SCORES[piece][sq]
+            self.phase += PHASE[piece]
+        else:
+            self.materialScore -= MATERIAL[piece]
+            self.mgScore -= MG_SCORES[piece][sq]
+            self.egScore -= EG_SCORES[piece][sq]
+            self.phase -= PHASE[piece]
 
     def makeMove(self, move):
         """
-        Takes a move as a parameter and executes it (this will not work for castling, pawn promotion, and en-passant)
+        Takes a move as a parameter and executes it, including castling, pawn promotion and en-passant
         :param move:
         :return:
         """
-        self.board[move.startRow][move.startCol] = "--"
-        self.board[move.endRow][move.endCol] = move.pieceMoved
-        self.moveLog.append(move)  # log the move so we can undo it later
+        self.makeMoveCode(move.code)
+
+    def makeMoveCode(self, code):
+        """
+        Execute a move given as a packed move code, see encodeMove. This is what the search calls
+        :param code:
+        :return:
+        """
+        board = self.board
+        startSq = code & 63
+        endSq = code >> 6 & 63
+        flag = code >> 12 & 3
+        startRow = startSq // 8
+        startCol = startSq % 8
+        endRow = endSq // 8
+        endCol = endSq % 8
+        pieceMoved = board[startRow][startCol]
+        # if en passant move, must update the board to capture the pawn
+        if flag == ENPASSANT_MOVE:
+            pieceCaptured = board[startRow][endCol]
+            board[startRow][endCol] = "--"
+            self.togglePiece(pieceCaptured, startRow * 8 + endCol)
+        else:
+            pieceCaptured = board[endRow][endCol]
+            if pieceCaptured != '--':
+                self.togglePiece(pieceCaptured, endSq)
+        # log the move so we can undo it later, packing the pieces into the same int
+        self.moveRecords.append(code | PIECE_INDEX[pieceMoved] << 16 | PIECE_INDEX[pieceCaptured] << 20)
+        board[startRow][startCol] = "--"
+        self.togglePiece(pieceMoved, startSq)
+        # pawn promotion
+        if flag == PROMOTION_MOVE:
+            piecePlaced = pieceMoved[0] + PROMOTION_PIECES[code >> 14]
+        else:
+            piecePlaced = pieceMoved
+        board[endRow][endCol] = piecePlaced
+        self.togglePiece(piecePlaced, endSq)
         self.whiteToMove = not self.whiteToMove  # swap players
+        self.zobristKey ^= ZOBRIST_BLACK_TO_MOVE
         # update King's position
-        if move.pieceMoved == "bK":
-            self.blackKingLocation = (move.endRow, move.endCol)
-        elif move.pieceMoved == "wK":
-            self.whiteKingLocation = (move.endRow, move.endCol)
-        # pawn promotion
-        if move.isPawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + "Q"
-        # enpassant move
-        # if move.isEnpassantMove:
-        #     print("here")
-        #     self.board[move.startRow][move.endCol] = '--'  # capturing the pawn
-        # if self.isEnpassantMove:
-        # print(move.moveID, move.startRow, move.startCol, move.pieceCaptured, move.pieceMoved, move.isEnpassantMove,
-        #       move.isCastleMove)
+        if pieceMoved == "bK":
+            self.blackKingLocation = (endRow, endCol)
+        elif pieceMoved == "wK":
+            self.whiteKingLocation = (endRow, endCol)
 
         # update enpassantPossible variable
-        if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-            self.enpassantPossible = ((move.startRow + move.endRow) // 2, move.endCol)
+        if self.enpassantPossible != ():
+            self.zobristKey ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        if pieceMoved[1] == 'p' and abs(startRow - endRow) == 2:
+            self.enpassantPossible = ((startRow + endRow) // 2, endCol)
+            self.zobristKey ^= ZOBRIST_ENPASSANT[endCol]
         else:
             self.enpassantPossible = ()
-        # if en passant move, must update the board to capture the pawn
-        if move.isEnpassantMove:
-            self.board[move.startRow][move.endCol] = "--"
+        self.enpassantPossibleLog.append(self.enpassantPossible)
+        # move counters
+        if pieceMoved[1] == 'p' or pieceCaptured != '--':
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        self.halfmoveClockLog.append(self.halfmoveClock)
+        if pieceMoved[0] == 'b':
+            self.fullmoveNumber += 1
 
         # castle move
-        if move.isCastleMove:
-            if move.endCol - move.startCol == 2:  # king side castle move
-                self.board[move.endRow][move.endCol - 1] = self.board[move.endRow][move.endCol + 1]
-                self.board[move.endRow][move.endCol + 1] = '--'
+        if flag == CASTLE_MOVE:
+            if endCol - startCol == 2:  # king side castle move
+                rook = board[endRow][endCol + 1]
+                board[endRow][endCol - 1] = rook
+                board[endRow][endCol + 1] = '--'
+                self.togglePiece(rook, endSq + 1)
+                self.togglePiece(rook, endSq - 1)
             else:  # queen side castle move
-                self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol - 2]
-                self.board[move.endRow][move.endCol - 2] = '--'
+                rook = board[endRow][endCol - 2]
+                board[endRow][endCol + 1] = rook
+                board[endRow][endCol - 2] = '--'
+                self.togglePiece(rook, endSq - 2)
+                self.togglePiece(rook, endSq + 1)
 
         # if castle move, must update the board to move the Rook and king
-        self.updateCastleRights(move)
+        self.zobristKey ^= ZOBRIST_CASTLING[self.currentCastlingRight.toIndex()]
+        self.updateCastleRights(pieceMoved, startSq, endSq)
+        self.zobristKey ^= ZOBRIST_CASTLING[self.currentCastlingRight.toIndex()]
         self.castleRightsLog.append(
             CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.wqs, self.currentCastlingRight.bks,
                          self.currentCastlingRight.bqs))
@@ -84,59 +459,140 @@ class GameState:
         :param :
         :return:
         """
-        if len(self.moveLog) != 0:
-            move = self.moveLog.pop()
-            # if flag:
-            #     self.redoMoveLog.append(move)
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+        if len(self.moveRecords) != 0:
+            record = self.moveRecords.pop()
+            board = self.board
+            startSq = record & 63
+            endSq = record >> 6 & 63
+            flag = record >> 12 & 3
+            startRow = startSq // 8
+            startCol = startSq % 8
+            endRow = endSq // 8
+            endCol = endSq % 8
+            pieceMoved = SQUARE_PIECES[record >> 16 & 15]
+            pieceCaptured = SQUARE_PIECES[record >> 20 & 15]
+            self.togglePiece(board[endRow][endCol], endSq)
+            self.togglePiece(pieceMoved, startSq)
+            board[startRow][startCol] = pieceMoved
             self.whiteToMove = not self.whiteToMove
+            self.zobristKey ^= ZOBRIST_BLACK_TO_MOVE
             # update King's position
-            if move.pieceMoved == "bK":
-                self.blackKingLocation = (move.startRow, move.startCol)
-            elif move.pieceMoved == "wK":
-                self.whiteKingLocation = (move.startRow, move.startCol)
+            if pieceMoved == "bK":
+                self.blackKingLocation = (startRow, startCol)
+            elif pieceMoved == "wK":
+                self.whiteKingLocation = (startRow, startCol)
             # undo enpassant move
-            if move.isEnpassantMove:
-                self.board[move.endRow][move.endCol] = '--'  # leave landing square blank
-                self.board[move.startRow][move.endCol] = move.pieceCaptured  # puts the pawn back on the correct square
-                self.enpassantPossible = (move.endRow, move.endCol)  # allow an enpassant to happen on the next move
-            # undo a 2 square pawn advance
-            if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-                self.enpassantPossible = ()
-            # undo castling rights
+            if flag == ENPASSANT_MOVE:
+                board[endRow][endCol] = '--'  # leave landing square blank
+                board[startRow][endCol] = pieceCaptured  # puts the pawn back on the correct square
+                self.togglePiece(pieceCaptured, startRow * 8 + endCol)
+            else:
+                board[endRow][endCol] = pieceCaptured
+                if pieceCaptured != '--':
+                    self.togglePiece(pieceCaptured, endSq)
+            if self.enpassantPossible != ():
+                self.zobristKey ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+            self.enpassantPossibleLog.pop()
+            self.enpassantPossible = self.enpassantPossibleLog[-1]
+            if self.enpassantPossible != ():
+                self.zobristKey ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+            self.halfmoveClockLog.pop()
+            self.halfmoveClock = self.halfmoveClockLog[-1]
+            if pieceMoved[0] == 'b':
+                self.fullmoveNumber -= 1
+            # undo castling rights, copying so the log entry is not mutated by the next move
+            self.zobristKey ^= ZOBRIST_CASTLING[self.currentCastlingRight.toIndex()]
             self.castleRightsLog.pop()
-            self.currentCastlingRight = self.castleRightsLog[-1]
+            lastRights = self.castleRightsLog[-1]
+            self.currentCastlingRight = CastleRights(lastRights.wks, lastRights.wqs, lastRights.bks, lastRights.bqs)
+            self.zobristKey ^= ZOBRIST_CASTLING[self.currentCastlingRight.toIndex()]
             # undo castle move
-            if move.isCastleMove:
-                if move.endCol - move.startCol == 2:  # king side castle move
-                    self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol - 1]
-                    self.board[move.endRow][move.endCol - 1] = "--"
+            if flag == CASTLE_MOVE:
+                if endCol - startCol == 2:  # king side castle move
+                    rook = board[endRow][endCol - 1]
+                    board[endRow][endCol + 1] = rook
+                    board[endRow][endCol - 1] = "--"
+                    self.togglePiece(rook, endSq - 1)
+                    self.togglePiece(rook, endSq + 1)
                 else:  # queen side castle move
-                    self.board[move.endRow][move.endCol - 2] = self.board[move.endRow][move.endCol + 1]
-                    self.board[move.endRow][move.endCol + 1] = "--"
+                    rook = board[endRow][endCol + 1]
+                    board[endRow][endCol - 2] = rook
+                    board[endRow][endCol + 1] = "--"
+                    self.togglePiece(rook, endSq + 1)
+                    self.togglePiece(rook, endSq - 2)
             self.checkMate = False
             self.staleMate = False
 
-    def updateCastleRights(self, move):
-        if move.pieceMoved == 'wK':
+    def makeNullMove(self):
+        """
+        Pass the turn without moving, for null-move pruning. Not legal chess, so never called when in check and never
+        recorded in the move log
+        :return:
+        """
+        if self.enpassantPossible != ():
+            self.zobristKey ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        self.enpassantPossible = ()
+        self.enpassantPossibleLog.append(self.enpassantPossible)
+        self.whiteToMove = not self.whiteToMove
+        self.zobristKey ^= ZOBRIST_BLACK_TO_MOVE
+
+    def undoNullMove(self):
+        """
+        Take back makeNullMove
+        :return:
+        """
+        self.enpassantPossibleLog.pop()
+        self.enpassantPossible = self.enpassantPossibleLog[-1]
+        if self.enpassantPossible != ():
+            self.zobristKey ^= ZOBRIST_ENPASSANT[self.enpassantPossible[1]]
+        self.whiteToMove = not self.whiteToMove
+        self.zobristKey ^= ZOBRIST_BLACK_TO_MOVE
+
+    @property
+    def moveLog(self):
+        """
+        The moves played so far as full Move objects, built on demand from the packed move records. Use lastMove when
+        only the last one is needed
+        :return:
+        """
+        return [moveFromRecord(record) for record in self.moveRecords]
+
+    def lastMove(self):
+        """
+        The last move played as a full Move object, built from its record alone
+        :return: None before the first move
+        """
+        if len(self.moveRecords) == 0:
+            return None
+        return moveFromRecord(self.moveRecords[-1])
+
+    def getMove(self, code):
+        """
+        The full Move object for a move code that is legal in the current position
+        :param code:
+        :return:
+        """
+        startSq = code & 63
+        endSq = code >> 6 & 63
+        return Move.fromCode(code, self.board[startSq // 8][startSq % 8], self.board[endSq // 8][endSq % 8])
+
+    def updateCastleRights(self, pieceMoved, startSq, endSq):
+        if pieceMoved == 'wK':
             self.currentCastlingRight.wks = False
             self.currentCastlingRight.wqs = False
-        elif move.pieceMoved == 'bK':
+        elif pieceMoved == 'bK':
             self.currentCastlingRight.bqs = False
             self.currentCastlingRight.bks = False
-        elif move.pieceMoved == 'wR':
-            if move.startRow == 7:
-                if move.startCol == 0:
-                    self.currentCastlingRight.wqs = False
-                elif move.startCol == 7:
-                    self.currentCastlingRight.wks = False
-        elif move.pieceMoved == 'bR':
-            if move.startRow == 0:
-                if move.startCol == 0:
-                    self.currentCastlingRight.wqs = False
-                elif move.startCol == 7:
-                    self.currentCastlingRight.wks = False
+        # a rook moving off its starting corner, or captured there, takes its castling right with it
+        for sq in (startSq, endSq):
+            if sq == 56:
+                self.currentCastlingRight.wqs = False
+            elif sq == 63:
+                self.currentCastlingRight.wks = False
+            elif sq == 0:
+                self.currentCastlingRight.bqs = False
+            elif sq == 7:
+                self.currentCastlingRight.bks = False
 
     # def redoMove(self):
     #     """
@@ -160,58 +616,15 @@ class GameState:
         All moves considering checks
         :return:
         """
-        # # 1. generate all possible moves
-        # # 5. if they do attack your king, not a valid move
-        # moves = self.getAllPossibleMoves()
-        # # 2. for each move, make the move
-        # for i in range(len(moves) - 1, -1, -1):
-        #     self.makeMove(moves[i])
-        #     # 3. generate all opponent's moves
-        #     # 4. for each of your opponent's moves, see if they attack your king
-        #     self.whiteToMove = not self.whiteToMove
-        #     if self.inCheck():
-        #         # 5. if they do attack your king, not a valid move
-        #         moves.remove(moves[i])
-        #     self.whiteToMove = not self.whiteToMove
-        #     self.undoMove()
+        return [self.getMove(code) for code in self.getValidMoveCodes()]
 
-        moves = []
-        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
-        if self.whiteToMove:
-            kingRow = self.whiteKingLocation[0]
-            kingCol = self.whiteKingLocation[1]
-        else:
-            kingRow = self.blackKingLocation[0]
-            kingCol = self.blackKingLocation[1]
-        if self.inCheck:
-            if len(self.checks) == 1:  # can either block check or move King
-                moves = self.getAllPossibleMoves()
-                # To block a check you must move a piece into one of the squares between the enemy piece and king
-                check = self.checks[0]  # check information
-                checkRow = check[0]
-                checkCol = check[1]
-                pieceChecking = self.board[checkRow][checkCol]  # enemy piece causing the check
-                validSquares = []  # squares that pieces can move to
-                # if knight, must capture knight or move king, other pieces can be blocked
-                if pieceChecking[1] == "N":
-                    validSquares = [(checkRow, checkCol)]
-                else:
-                    for i in range(1, 8):
-                        validSquare = (kingRow + check[2] * i, kingCol + check[3] * i)  # check[2] and check[3) are the
-                        validSquares.append(validSquare)
-                        if validSquare[0] == checkRow and validSquare[1] == checkCol:  # once you get to piece end check
-                            # directions
-                            break
-                # get rid of any moves that don't block check or move king
-                for i in range(len(moves) - 1, -1, -1):
-                    if moves[i].pieceMoved[1] != "K":
-                        if not (moves[i].endRow, moves[i].endCol) in validSquares:
-                            moves.remove(moves[i])
-            else:  # double check only king has to move
-                self.getKingMoves(kingRow, kingCol, moves)
-        else:
-            moves = self.getAllPossibleMoves()
-            self.getCastleMoves(kingRow, kingCol, moves)
+    def getValidMoveCodes(self):
+        """
+        All moves considering checks, as packed move codes
+        :return:
+        """
+        self.prepareMoveGeneration()
+        moves = self.getMoveCodes(ALL_MOVES)
         if len(moves) == 0:  # can be either checkmate or stalemate
             if self.inCheck:
                 self.checkMate = True
@@ -222,8 +635,78 @@ class GameState:
             self.checkMate = False
         return moves
 
+    def getCaptureMoveCodes(self):
+        """
+        Legal captures and promotions only, for the quiescence search. When in check every legal move is returned,
+        since all evasions have to be looked at
+        :return:
+        """
+        self.prepareMoveGeneration()
+        return self.getMoveCodes(ALL_MOVES if self.inCheck else CAPTURE_MOVES)
+
+    def prepareMoveGeneration(self):
+        """
+        Find the pins and checks of the side to move and the squares pieces other than the king may move to: anywhere
+        when not in check, onto the checking piece or between it and the king in single check, nowhere in double check
+        :return:
+        """
+        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        if not self.inCheck:
+            self.checkMask = ALL_SQUARES
+        elif len(self.checks) == 1:
+            checkRow, checkCol, dRow, dCol = self.checks[0]
+            checkSq = checkRow * 8 + checkCol
+            self.checkMask = 1 << checkSq
+            if self.board[checkRow][checkCol][1] != "N":  # other pieces can be blocked on the line to the king
+                kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+                self.checkMask |= RAYS[(dRow, dCol)][kingRow * 8 + kingCol] & ~RAYS[(dRow, dCol)][checkSq]
+        else:  # double check only king has to move
+            self.checkMask = 0
+
+    def getMoveCodes(self, kind):
+        """
+        Legal moves of one kind: ALL_MOVES, CAPTURE_MOVES or QUIET_MOVES. Uses the pins and check mask of the last
+        prepareMoveGeneration, which must have been called for the current position
+        :param kind:
+        :return:
+        """
+        moves = []
+        self.getPawnMoves(moves, kind)
+        for piece in ('N', 'B', 'R', 'Q'):
+            self.getPieceMoves(piece, moves, kind)
+        self.getKingMoves(moves, kind)
+        if kind != CAPTURE_MOVES:
+            r, c = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+            self.getCastleMoves(r, c, moves)
+        return moves
+
+    def isLegalMoveCode(self, code):
+        """
+        Whether a move code, e.g. a hash or killer move remembered from another position, is legal here. Only the
+        moves of the piece on its start square are generated. Needs prepareMoveGeneration like getMoveCodes
+        :param code:
+        :return:
+        """
+        startSq = code & 63
+        piece = self.board[startSq // 8][startSq % 8]
+        if piece[0] != ('w' if self.whiteToMove else 'b'):
+            return False
+        moves = []
+        if piece[1] == 'p':
+            self.getPawnMoves(moves)
+        elif piece[1] == 'K':
+            self.getKingMoves(moves)
+            self.getCastleMoves(startSq // 8, startSq % 8, moves)
+        else:
+            self.getPieceMoves(piece[1], moves, pieces=1 << startSq)
+        return code in moves
+
     def checkForPinsAndChecks(self):
-        pins = []  # squares where the allied pinned piece is and direction pinned from
+        """
+        Scan outward from the king of the side to move along the ray tables
+        :return: inCheck, pins as {square: bitboard of the pin line}, checks as [(row, col, dRow, dCol)]
+        """
+        pins = {}  # squares where the allied pinned piece is and direction pinned from
         checks = []  # squares where enemy is applying a check
         inCheck = False
         if self.whiteToMove:
@@ -231,59 +714,51 @@ class GameState:
             allyColor = "w"
             startRow = self.whiteKingLocation[0]
             startCol = self.whiteKingLocation[1]
+            pawnDirection = -1
         else:
             enemyColor = "w"
             allyColor = "b"
             startRow = self.blackKingLocation[0]
             startCol = self.blackKingLocation[1]
-        # check outward from king for pins and checks, keep track of pins
-        directions = [(-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
-        for j in range(len(directions)):
-            d = directions[j]
-            possiblePin = ()  # reset possible pins
-            for i in range(1, 8):
-                endRow = startRow + d[0] * i
-                endCol = startCol + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == allyColor and endPiece[1] != "K":
-                        if possiblePin == ():  # 1st allied piece could pe pinned
-                            possiblePin = (endRow, endCol, d[0], d[1])
-                        else:
-                            break
-                    elif endPiece[0] == enemyColor:
-                        typeOfPiece = endPiece[1]
-                        # Five possibilities here in this complex conditional statement
-                        # 1. Orthogonally away from king and piece is a rook
-                        # 2. Diagonally away from king and piece is a bishop
-                        # 3. 1 square  diagonally away from king and piece is a pawn
-                        # 5. Any direction 1 square away and piece is a king (this is necessary to prevent a king move
-                        # to a square that controlled by another king)
-                        if (0 <= j <= 3 and typeOfPiece == "R") or (4 <= j <= 7 and typeOfPiece == "B") \
-                                or (i == 1 and typeOfPiece == "p" and (
-                                (enemyColor == "w" and 6 <= j <= 7) or (enemyColor == "b" and 4 <= j <= 5))) \
-                                or (typeOfPiece == "Q") or (i == 1 and typeOfPiece == "K"):
-                            if possiblePin == ():  # No piece blocking, so check
-                                inCheck = True
-                                checks.append((endRow, endCol, d[0], d[1]))
-                                break
-                            else:  # piece blocking so pin
-                                pins.append(possiblePin)
-                                break
-                        else:  # enemy piece not applying check
-                            break
-                else:  # off board
-                    break
+            pawnDirection = 1
+        kingSq = startRow * 8 + startCol
+        # the king itself does not block rays, so it cannot hide behind its own square when stepping back
+        occupied = self.occupied & ~self.bitboards[allyColor + "K"]
+        allies = self.occupancy[allyColor] & occupied
+        orthogonalAttackers = self.bitboards[enemyColor + "R"] | self.bitboards[enemyColor + "Q"]
+        diagonalAttackers = self.bitboards[enemyColor + "B"] | self.bitboards[enemyColor + "Q"]
+        for d in KING_STEPS:
+            attackers = (orthogonalAttackers if d in ORTHOGONAL else diagonalAttackers) & RAYS[d][kingSq]
+            if not attackers:  # nothing on this ray can pin or give check
+                continue
+            endSq = firstBlocker(d, kingSq, occupied)
+            if allies >> endSq & 1:  # 1st allied piece could be pinned
+                pinnerSq = firstBlocker(d, endSq, occupied)
+                if pinnerSq >= 0 and attackers >> pinnerSq & 1:
+                    pins[endSq] = RAYS[d][kingSq] | RAYS[(-d[0], -d[1])][kingSq]
+            elif attackers >> endSq & 1:  # no piece blocking, so check
+                inCheck = True
+                checks.append((endSq // 8, endSq % 8, d[0], d[1]))
+        # pawns and the enemy king only attack from one square away
+        pawns = PAWN_ATTACKS[allyColor][kingSq] & self.bitboards[enemyColor + "p"]
+        while pawns:
+            pawn = pawns & -pawns
+            pawns ^= pawn
+            endSq = pawn.bit_length() - 1
+            inCheck = True
+            checks.append((endSq // 8, endSq % 8, pawnDirection, endSq % 8 - startCol))
+        if KING_TABLE[kingSq] & self.bitboards[enemyColor + "K"]:
+            inCheck = True
+            enemyKingSq = self.bitboards[enemyColor + "K"].bit_length() - 1
+            checks.append((enemyKingSq // 8, enemyKingSq % 8, enemyKingSq // 8 - startRow, enemyKingSq % 8 - startCol))
         # check for knight checks
-        knightMoves = [(-2, -1), (-2, 1), (2, -1), (2, 1), (1, -2), (1, 2), (-1, -2), (-1, 2)]
-        for m in knightMoves:
-            endRow = startRow + m[0]
-            endCol = startCol + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor and endPiece[1] == "N":  # enemy knight attacking king
-                    inCheck = True
-                    checks.append((endRow, endCol, m[0], m[1]))
+        knights = KNIGHT_TABLE[kingSq] & self.bitboards[enemyColor + "N"]
+        while knights:
+            knight = knights & -knights
+            knights ^= knight
+            endSq = knight.bit_length() - 1
+            inCheck = True
+            checks.append((endSq // 8, endSq % 8, endSq // 8 - startRow, endSq % 8 - startCol))
         return inCheck, pins, checks
 
     # def inCheck(self):
@@ -296,6 +771,14 @@ class GameState:
     #     else:
     #         return self.squareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])
 
+    def isKingAttacked(self):
+        """
+        Determine if the side to move is in check, a single attackersTo lookup without the pin scan
+        :return:
+        """
+        color, enemy = ('w', 'b') if self.whiteToMove else ('b', 'w')
+        return bool(self.attackersTo(self.bitboards[color + 'K'].bit_length() - 1, enemy))
+
     def squareUnderAttack(self, r, c):
         """
         Determine if the enemy can attack the square r, c
@@ -303,213 +786,181 @@ class GameState:
         :param c:
         :return:
         """
-        self.whiteToMove = not self.whiteToMove
-        oppMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c:
-                return True
-        return False
+        return bool(self.attackersTo(r * 8 + c, 'b' if self.whiteToMove else 'w'))
 
-    def getAllPossibleMoves(self):
+    def attackersTo(self, sq, color, occupied=None):
         """
-        All moves without considering checks
+        Bitboard of the pieces of color attacking sq, looked up from the attack tables from sq outwards
+        :param sq:
+        :param color:
+        :param occupied: occupancy to slide through, defaults to the current board
         :return:
         """
-        moves = []
-        for r in range(len(self.board)):
-            for c in range(len(self.board[r])):
-                turn = self.board[r][c][0]
-                if (turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):
-                    piece = self.board[r][c][1]
-                    self.moveFunctions[piece](r, c, moves)
-        return moves
+        bitboards = self.bitboards
+        attackers = (PAWN_ATTACKS['b' if color == 'w' else 'w'][sq] & bitboards[color + 'p'] |
+                     KNIGHT_TABLE[sq] & bitboards[color + 'N'] | KING_TABLE[sq] & bitboards[color + 'K'])
+        if occupied is None:
+            occupied = self.occupied
+        queens = bitboards[color + 'Q']
+        orthogonalAttackers = (bitboards[color + 'R'] | queens) & ORTHOGONAL_LINES[sq]
+        if orthogonalAttackers:
+            attackers |= slidingAttacks(sq, occupied, ORTHOGONAL) & orthogonalAttackers
+        diagonalAttackers = (bitboards[color + 'B'] | queens) & DIAGONAL_LINES[sq]
+        if diagonalAttackers:
+            attackers |= slidingAttacks(sq, occupied, DIAGONAL) & diagonalAttackers
+        return attackers
 
-    def getPawnMoves(self, r, c, moves):
+    def addMoves(self, sq, targets, moves):
         """
-        Get all the pawn moves for the pawn located at row, col and add these moves to the list
-        :param r:
-        :param c:
+        Add a move from sq to every square of the targets bitboard, keeping a pinned piece on its pin line
+        :param sq:
+        :param targets:
         :param moves:
         :return:
         """
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-        if self.whiteToMove:  # white pawn moves
-            if self.board[r - 1][c] == '--':  # 1 square pawn advance
-                if not piecePinned or pinDirection == (-1, 0):
-                    moves.append(Move((r, c), (r - 1, c), self.board))
-                    if r == 6 and self.board[r - 2][c] == "--":  # 2 square pawn advance
-                        moves.append(Move((r, c), (r - 2, c), self.board))
-            if c - 1 >= 0:  # captures to the left
-                if self.board[r - 1][c - 1][0] == 'b':  # enemy piece to capture
-                    if not piecePinned or pinDirection == (-1, -1):
-                        moves.append(Move((r, c), (r - 1, c - 1), self.board))
-                elif (r - 1, c - 1) == self.enpassantPossible:
-                    if not piecePinned or pinDirection == (-1, -1):
-                        moves.append(Move((r, c), (r - 1, c - 1), self.board, isEnpassantPossible=True))
-
-            if c + 1 <= 7:  # captures to the right
-                if self.board[r - 1][c + 1][0] == 'b':  # enemy piece to capture
-                    if not piecePinned or pinDirection == (-1, 1):
-                        moves.append(Move((r, c), (r - 1, c + 1), self.board))
-                elif (r - 1, c + 1) == self.enpassantPossible:
-                    if not piecePinned or pinDirection == (-1, 1):
-                        moves.append(Move((r, c), (r - 1, c + 1), self.board, isEnpassantPossible=True))
-
-        else:  # black pawn moves
-            if self.board[r + 1][c] == '--':  # 1 square pawn advance
-                if not piecePinned or pinDirection == (1, 0):
-                    moves.append(Move((r, c), (r + 1, c), self.board))
-                    if r == 1 and self.board[r + 2][c] == "--":  # 2 square pawn advance
-                        moves.append(Move((r, c), (r + 2, c), self.board))
-
-            if c - 1 >= 0:  # captures to the left
-                if self.board[r + 1][c - 1][0] == 'w':  # enemy piece to capture
-                    if not piecePinned or pinDirection == (1, -1):
-                        moves.append(Move((r, c), (r + 1, c - 1), self.board))
-                elif (r + 1, c - 1) == self.enpassantPossible:
-                    if not piecePinned or pinDirection == (1, -1):
-                        moves.append(Move((r, c), (r + 1, c - 1), self.board, isEnpassantPossible=True))
-            if c + 1 <= 7:  # captures to the right
-                if self.board[r + 1][c + 1][0] == 'w':  # enemy piece to capture
-                    if not piecePinned or pinDirection == (1, 1):
-                        moves.append(Move((r, c), (r + 1, c + 1), self.board))
-                elif (r + 1, c + 1) == self.enpassantPossible:
-                    if not piecePinned or pinDirection == (1, 0):
-                        moves.append(Move((r, c), (r + 1, c + 1), self.board, isEnpassantPossible=True))
-
-    def getRookMoves(self, r, c, moves):
-        """
-        Get all the Rook moves for the pawn located at row, col and add these moves to the list
-        :param r:
-        :param c:
+        if sq in self.pins:
+            targets &= self.pins[sq]
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            moves.append(sq | (bit.bit_length() - 1) << 6)
+
+    def getPawnMoves(self, moves, kind=ALL_MOVES):
+        """
+        Get all the pawn moves for the side to move, shifting the whole pawn bitboard at once
         :param moves:
+        :param kind: ALL_MOVES, CAPTURE_MOVES or QUIET_MOVES
         :return:
         """
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                if self.board[r][c][1] != "Q":  # can't remove queen from pin on rook moves, only remove it on bishop
-                    # moves
-                    self.pins.remove(self.pins[i])
-                break
-        directions = [(1, 0), (-1, 0), (0, 1), (0, -1)]
-        enemy = "b" if self.whiteToMove else "w"
-        for d in directions:
-            for i in range(1, 8):
-                row = r + d[0] * i
-                col = c + d[1] * i
-                if 0 <= row < 8 and 0 <= col < 8:
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        if self.board[row][col] == "--":
-                            moves.append(Move((r, c), (row, col), self.board))
-                        elif self.board[row][col][0] == enemy:
-                            moves.append(Move((r, c), (row, col), self.board))
-                            break
-                        else:
-                            break
-                else:
-                    break
-
-    def getKnightMoves(self, r, c, moves):
-        """
-                Get all the Knight moves for the pawn located at row, col and add these moves to the list
-                :param r:
-                :param c:
-                :param moves:
-                :return:
-        """
-        piecePinned = False
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                self.pins.remove(self.pins[i])
-                break
-        directions = [(-2, -1), (-2, 1), (2, -1), (2, 1), (1, -2), (1, 2), (-1, -2), (-1, 2)]
-        notEnemy = "w" if self.whiteToMove else "b"
-        for d in directions:
-            row = r + d[0]
-            col = c + d[1]
-            if 0 <= row < 8 and 0 <= col < 8:
-                if not piecePinned:
-                    if self.board[row][col][0] != notEnemy:
-                        moves.append(Move((r, c), (row, col), self.board))
-
-    def getBishopMoves(self, r, c, moves):
-        """
-                Get all the Bishop moves for the pawn located at row, col and add these moves to the list
-                :param r:
-                :param c:
-                :param moves:
-                :return:
-        """
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-        directions = [(1, 1), (-1, 1), (1, -1), (-1, -1)]
-        enemy = "b" if self.whiteToMove else "w"
-        for d in directions:
-            for i in range(1, 8):
-                row = r + d[0] * i
-                col = c + d[1] * i
-                if 0 <= row < 8 and 0 <= col < 8:
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        if self.board[row][col] == "--":
-                            moves.append(Move((r, c), (row, col), self.board))
-                        elif self.board[row][col][0] == enemy:
-                            moves.append(Move((r, c), (row, col), self.board))
-                            break
-                        else:
-                            break
+        empty = ~self.occupied
+        if self.whiteToMove:
+            pawns = self.bitboards['wp']
+            enemy = self.occupancy['b']
+            forward = -8
+            single = pawns >> 8 & empty
+            double = (single & ROWS[5]) >> 8 & empty
+            left = (pawns & ~FILE_A) >> 9
+            right = (pawns & ~FILE_H) >> 7
+            capturedShift = 8
+        else:
+            pawns = self.bitboards['bp']
+            enemy = self.occupancy['w']
+            forward = 8
+            single = pawns << 8 & empty
+            double = (single & ROWS[2]) << 8 & empty
+            left = (pawns & ~FILE_A) << 7
+            right = (pawns & ~FILE_H) << 9
+            capturedShift = -8
+        single &= self.checkMask
+        double &= self.checkMask
+        enemy &= self.checkMask
+        if kind == CAPTURE_MOVES:
+            single &= PROMOTION_ROWS
+            double = 0
+        elif kind == QUIET_MOVES:
+            single &= ~PROMOTION_ROWS
+            enemy = 0
+        enpassant = 0
+        if self.enpassantPossible != () and kind != QUIET_MOVES:
+            enpassantSq = self.enpassantPossible[0] * 8 + self.enpassantPossible[1]
+            # in check, en passant must land between the checker and the king or take the checking pawn
+            if self.checkMask >> enpassantSq & 1 or self.checkMask >> (enpassantSq + capturedShift) & 1:
+                enpassant = 1 << enpassantSq
+        for targets, shift in ((single, forward), (double, 2 * forward), (left & enemy, forward - 1),
+                               (right & enemy, forward + 1)):
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                endSq = bit.bit_length() - 1
+                startSq = endSq - shift
+                if startSq in self.pins and not self.pins[startSq] >> endSq & 1:
+                    continue
+                if bit & PROMOTION_ROWS:
+                    for promotionIndex in range(len(PROMOTION_PIECES)):
+                        moves.append(startSq | endSq << 6 | PROMOTION_MOVE << 12 | promotionIndex << 14)
                 else:
-                    break
+                    moves.append(startSq | endSq << 6)
+        for targets, shift in ((left & enpassant, forward - 1), (right & enpassant, forward + 1)):
+            if targets:
+                endSq = targets.bit_length() - 1
+                startSq = endSq - shift
+                if startSq in self.pins and not self.pins[startSq] >> endSq & 1:
+                    continue
+                if self.enpassantExposesKing(startSq, endSq):
+                    continue
+                moves.append(startSq | endSq << 6 | ENPASSANT_MOVE << 12)
 
-    def getKingMoves(self, r, c, moves):
+    def enpassantExposesKing(self, startSq, endSq):
         """
-                Get all the King moves for the pawn located at row, col and add these moves to the list
-                :param r:
-                :param c:
-                :param moves:
-                :return:
+        En passant takes two pawns off the same row at once, which the pin scan cannot see. Replay the capture on the
+        occupancy and look for a slider hitting the king
+        :param startSq:
+        :param endSq:
+        :return:
         """
-        directions = [(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)]
-        notEnemy = "w" if self.whiteToMove else "b"
-        for d in directions:
-            row = r + d[0]
-            col = c + d[1]
-            if 0 <= row < 8 and 0 <= col < 8:
-                endPiece = self.board[row][col]
-                if endPiece[0] != notEnemy:
-                    # place king on end square and check for checks
-                    if notEnemy == "w":
-                        self.whiteKingLocation = (row, col)
-                    else:
-                        self.blackKingLocation = (row, col)
-                    inCheck, pins, checks = self.checkForPinsAndChecks()
-                    if not inCheck:
-                        moves.append(Move((r, c), (row, col), self.board))
-                    if notEnemy == "w":
-                        self.whiteKingLocation = (r, c)
-                    else:
-                        self.blackKingLocation = (r, c)
+        color, enemy = ('w', 'b') if self.whiteToMove else ('b', 'w')
+        kingSq = self.bitboards[color + 'K'].bit_length() - 1
+        capturedSq = startSq // 8 * 8 + endSq % 8
+        occupied = (self.occupied ^ (1 << startSq) ^ (1 << capturedSq)) | 1 << endSq
+        queens = self.bitboards[enemy + 'Q']
+        return bool(slidingAttacks(kingSq, occupied, ORTHOGONAL) & (self.bitboards[enemy + 'R'] | queens) or
+                    slidingAttacks(kingSq, occupied, DIAGONAL) & (self.bitboards[enemy + 'B'] | queens))
+
+    def getPieceMoves(self, piece, moves, kind=ALL_MOVES, pieces=None):
+        """
+        Get all the moves for the knights, bishops, rooks or queens of the side to move
+        :param piece:
+        :param moves:
+        :param kind: ALL_MOVES, CAPTURE_MOVES or QUIET_MOVES
+        :param pieces: bitboard of the pieces to move, all of them by default
+        :return:
+        """
+        color = 'w' if self.whiteToMove else 'b'
+        if kind == CAPTURE_MOVES:
+            notOwn = self.occupancy['b' if self.whiteToMove else 'w']
+        elif kind == QUIET_MOVES:
+            notOwn = ~self.occupied
+        else:
+            notOwn = ~self.occupancy[color]
+        notOwn &= self.checkMask
+        if pieces is None:
+            pieces = self.bitboards[color + piece]
+        while pieces:
+            bit = pieces & -pieces
+            pieces ^= bit
+            sq = bit.bit_length() - 1
+            if piece == 'N':
+                targets = KNIGHT_TABLE[sq]
+            else:
+                targets = slidingAttacks(sq, self.occupied, SLIDER_DIRECTIONS[piece])
+            self.addMoves(sq, targets & notOwn, moves)
+
+    def getKingMoves(self, moves, kind=ALL_MOVES):
+        """
+        Get all the King moves for the side to move and add these moves to the list
+        :param moves:
+        :param kind: ALL_MOVES, CAPTURE_MOVES or QUIET_MOVES
+        :return:
+        """
+        color, enemy = ('w', 'b') if self.whiteToMove else ('b', 'w')
+        r, c = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        kingSq = r * 8 + c
+        targets = KING_TABLE[kingSq] & ~self.occupancy[color]
+        if kind == CAPTURE_MOVES:
+            targets &= self.occupied
+        elif kind == QUIET_MOVES:
+            targets &= ~self.occupied
+        # the king does not shield the squares behind it from a slider it steps away from
+        occupied = self.occupied ^ (1 << kingSq)
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            endSq = bit.bit_length() - 1
+            if not self.attackersTo(endSq, enemy, occupied):
+                moves.append(kingSq | endSq << 6)
 
     def getCastleMoves(self, r, c, moves):
-        if self.inCheck:
+        if self.inCheck or c != 4 or r != (7 if self.whiteToMove else 0):  # the rights only hold for a king at home
             return
         if (self.whiteToMove and self.currentCastlingRight.wks) or (
                 not self.whiteToMove and self.currentCastlingRight.bks):
@@ -519,25 +970,18 @@ class GameState:
             self.getQueenSideCastleMoves(r, c, moves)
 
     def getKingSideCastleMoves(self, r, c, moves):
+        if self.board[r][c + 3][1] != 'R' or self.board[r][c + 3][0] != self.board[r][c][0]:
+            return
         if self.board[r][c + 1] == '--' and self.board[r][c + 2] == '--':
             if not self.squareUnderAttack(r, c + 1) and not self.squareUnderAttack(r, c + 2):
-                moves.append(Move((r, c), (r, c + 2), self.board, isCastle=True))
+                moves.append(encodeMove(r * 8 + c, r * 8 + c + 2, CASTLE_MOVE))
 
     def getQueenSideCastleMoves(self, r, c, moves):
-        if self.board[r][c - 1] == '--' and self.board[r][c - 2] == '--':
+        if self.board[r][c - 4][1] != 'R' or self.board[r][c - 4][0] != self.board[r][c][0]:
+            return
+        if self.board[r][c - 1] == '--' and self.board[r][c - 2] == '--' and self.board[r][c - 3] == '--':
             if not self.squareUnderAttack(r, c - 1) and not self.squareUnderAttack(r, c - 2):
-                moves.append(Move((r, c), (r, c - 2), self.board, isCastle=True))
-
-    def getQueenMoves(self, r, c, moves):
-        """
-                Get all the Queen moves for the pawn located at row, col and add these moves to the list
-                :param r:
-                :param c:
-                :param moves:
-                :return:
-        """
-        self.getBishopMoves(r, c, moves)
-        self.getRookMoves(r, c, moves)
+                moves.append(encodeMove(r * 8 + c, r * 8 + c - 2, CASTLE_MOVE))
 
 
 class CastleRights:
@@ -547,6 +991,13 @@ class CastleRights:
         self.bks = bks
         self.bqs = bqs
 
+    def toIndex(self):
+        """
+        Packs the four rights into 0..15, used to pick the castling Zobrist key
+        :return:
+        """
+        return self.wks | self.wqs << 1 | self.bks << 2 | self.bqs << 3
+
 
 class Move:
     # maps keys to values
@@ -558,25 +1009,61 @@ class Move:
                    "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
-    def __init__(self, startSq, endSq, board, isEnpassantPossible=False, isCastle=False):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
+    promotionPieces = PROMOTION_PIECES
+
+    # the search only ever sees the packed code, these objects are built for the GUI, notation and the move log
+    __slots__ = ("code", "startRow", "startCol", "endRow", "endCol", "pieceMoved", "pieceCaptured", "isPawnPromotion",
+                 "promotionPiece", "isEnpassantMove", "isCastleMove", "moveID")
+
+    def __init__(self, startSq, endSq, board, isEnpassantPossible=False, isCastle=False, promotionPiece="Q"):
+        pieceMoved = board[startSq[0]][startSq[1]]
+        if isEnpassantPossible:
+            flag = ENPASSANT_MOVE
+        elif isCastle:
+            flag = CASTLE_MOVE
+        elif (endSq[0] == 0 and pieceMoved == 'wp') or (endSq[0] == 7 and pieceMoved == 'bp'):
+            flag = PROMOTION_MOVE
+        else:
+            flag = NORMAL_MOVE
+        code = encodeMove(startSq[0] * 8 + startSq[1], endSq[0] * 8 + endSq[1], flag, promotionPiece)
+        self.setFromCode(code, pieceMoved, board[endSq[0]][endSq[1]])
+
+    @classmethod
+    def fromCode(cls, code, pieceMoved, pieceCaptured):
+        """
+        Build the full Move for a packed move code
+        :param code:
+        :param pieceMoved:
+        :param pieceCaptured: what stood on the end square, ignored for en passant
+        :return:
+        """
+        move = cls.__new__(cls)
+        move.setFromCode(code, pieceMoved, pieceCaptured)
+        return move
+
+    def setFromCode(self, code, pieceMoved, pieceCaptured):
+        self.code = code
+        startSq = code & 63
+        endSq = code >> 6 & 63
+        flag = code >> 12 & 3
+        self.startRow = startSq // 8
+        self.startCol = startSq % 8
+        self.endRow = endSq // 8
+        self.endCol = endSq % 8
+        self.pieceMoved = pieceMoved
+        self.pieceCaptured = pieceCaptured
         # pawn promotion
-        self.isPawnPromotion = (self.endRow == 0 and self.pieceMoved == 'wp') or \
-                               (self.endRow == 7 and self.pieceMoved == 'bp')
+        self.isPawnPromotion = flag == PROMOTION_MOVE
+        self.promotionPiece = PROMOTION_PIECES[code >> 14] if self.isPawnPromotion else None
         # Enpassant
-        self.isEnpassantMove = isEnpassantPossible
+        self.isEnpassantMove = flag == ENPASSANT_MOVE
         if self.isEnpassantMove:
-            self.pieceCaptured = 'wp' if self.pieceMoved == 'bp' else 'bp'
+            self.pieceCaptured = 'wp' if pieceMoved == 'bp' else 'bp'
         # Castling
-        self.isCastleMove = isCastle
+        self.isCastleMove = flag == CASTLE_MOVE
         self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
-        # if self.isCastleMove:
-        #           self.isCastleMove)
+        if self.isPawnPromotion:  # under-promotions get their own ids, a queen promotion keeps the plain one
+            self.moveID += (code >> 14) * 10000
 
     def __eq__(self, other):
         """
@@ -589,7 +1076,10 @@ class Move:
         return False
 
     def getChessNotation(self):
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.isPawnPromotion:
+            notation += self.promotionPiece.lower()
+        return notation
 
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
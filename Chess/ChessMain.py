@@ -1,11 +1,17 @@
 import pygame as p
-from Chess import ChessEngine, SmartMoveFinder
+from Chess import ChessEngine, OpeningBook, SmartMoveFinder
 
 WIDTH = HEIGHT = 512
 DIMENSION = 8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 15
+AI_TIME_LIMIT = 3  # seconds the AI may think per move
+AI_WORKERS = 1  # processes the AI search is split across
+PONDER = True  # search the position after the expected reply while the human thinks
+PONDER_TIME_LIMIT = 60  # seconds a ponder search may run when the human takes long to reply
 IMAGES = {}
+SURFACES = {}  # the empty board and the highlight squares, rendered once by loadSurfaces
+FONTS = {}  # (name, size, bold, italic) -> font, created on first use
 colors = []
 
 
@@ -18,6 +24,28 @@ def loadImages():
         IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE))
 
 
+def loadSurfaces():
+    """
+    Pre-render what the frames are drawn from: the empty board and the translucent squares marking the selected piece
+    and its moves. This will be called exactly once in the main
+    """
+    board = p.Surface((WIDTH, HEIGHT))
+    drawBoard(board)
+    SURFACES['board'] = board
+    for highlight, color in (('selected', 'orange'), ('target', 'yellow')):
+        s = p.Surface((SQ_SIZE, SQ_SIZE))
+        s.set_alpha(100)
+        s.fill(p.Color(color))
+        SURFACES[highlight] = s
+
+
+def getFont(name, size, bold=False, italic=False):
+    key = (name, size, bold, italic)
+    if key not in FONTS:
+        FONTS[key] = p.font.SysFont(name, size, bold, italic)
+    return FONTS[key]
+
+
 def main():
     """
     The main driver for our code. This will handle user input and updating the graphics
@@ -28,20 +56,28 @@ def main():
     screen.fill(p.Color("white"))
     gs = ChessEngine.GameState()
     validMoves = gs.getValidMoves()
+    book = OpeningBook.openBook()  # None when no book has been built
     moveMade = False  # flag variable for when a move is made
     animate = False
     loadImages()
+    loadSurfaces()
+    drawn = {}  # what the screen shows, so a frame only redraws the squares that changed
     running = True
     sqSelected = ()  # no square is selected,keep track of the last click of the user
     playerClicks = []  # keep track of player clicks (two tuples: [(6,4), (4,4)])
     gameOver = False
     playerOne = False  # if a human is playing white, then this will be True
     playerTwo = False  # Same as above but for black
+    aiSearch = None  # the AI search running in the background, if any
+    ponderSearch = None  # the search of the position after the reply the AI expects, while the human thinks
+    ponderMove = None  # that reply in coordinate notation
     while running:
         humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
+            elif e.type == p.VIDEOEXPOSE:  # the window was uncovered, its contents may be gone
+                drawn.clear()
             # mouse handlers
             elif e.type == p.MOUSEBUTTONDOWN:
                 if not gameOver and humanTurn:
@@ -57,22 +93,37 @@ def main():
                     if len(playerClicks) == 2:  # append 2nd click
                         move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board)
                         print(move.getChessNotation())
-                        if move in validMoves:
-                            gs.makeMove(move)
-                            moveMade = True
-                            animate = True
-                            sqSelected = ()
-                            playerClicks = []
-                        else:
+                        for validMove in validMoves:
+                            if move == validMove:
+                                # play the generated move, it carries the castle and en-passant flags
+                                gs.makeMove(validMove)
+                                moveMade = True
+                                animate = True
+                                sqSelected = ()
+                                playerClicks = []
+                                break
+                        if not moveMade:
                             playerClicks = [sqSelected]
             # keyboard handlers
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z:  # undo when 'z' is pressed
+                    if aiSearch is not None:  # its move would be for the position being taken back
+                        aiSearch.cancel()
+                        aiSearch = None
+                    if ponderSearch is not None:
+                        ponderSearch.cancel()
+                        ponderSearch = None
                     gs.undoMove()
                     validMoves = gs.getValidMoves()
                     moveMade = True
                     gameOver = False
                 if e.key == p.K_r:  # reset the board when 'r' is pressed
+                    if aiSearch is not None:
+                        aiSearch.cancel()
+                        aiSearch = None
+                    if ponderSearch is not None:
+                        ponderSearch.cancel()
+                        ponderSearch = None
                     gs = ChessEngine.GameState()
                     validMoves = gs.getValidMoves()
                     sqSelected = ()
@@ -86,80 +137,159 @@ def main():
                 #     moveMade = True
                 elif e.key == p.K_c:
                     exit()
-        # AI move finder logic
-        if not gameOver and not humanTurn:
-            # if gs.whiteToMove:
-            AIMove = SmartMoveFinder.findBestMoveMinMax(gs, validMoves)
-            if AIMove is None:
-                AIMove = SmartMoveFinder.findRandomMove(validMoves)
-            # else:
-            #     AIMove = SmartMoveFinder.moveFinder(gs, validMoves)
-            #     if AIMove is None:
-            #         AIMove = SmartMoveFinder.findRandomMove(validMoves)
-
-            gs.makeMove(AIMove)
-            moveMade = True
-            animate = False
+        # AI move finder logic: the search runs on a worker thread and the loop keeps drawing until its move is ready
+        if not gameOver and not humanTurn and running:
+            AIMove = None
+            aiStats = None
+            if aiSearch is None and ponderSearch is not None:
+                if gs.lastMove().getChessNotation() == ponderMove:  # ponder hit, that search goes on for real
+                    ponderSearch.ponderhit(AI_TIME_LIMIT)
+                    aiSearch = ponderSearch
+                else:
+                    ponderSearch.cancel()
+                ponderSearch = None
+            if aiSearch is None:
+                AIMove = book.chooseMove(gs, validMoves) if book is not None else None
+                if AIMove is None:  # out of book
+                    aiSearch = SmartMoveFinder.BackgroundSearch(SmartMoveFinder.defaultEngine, gs,
+                                                                SmartMoveFinder.SearchLimits(timeLimit=AI_TIME_LIMIT,
+                                                                                             workers=AI_WORKERS),
+                                                                validMoves)
+            elif aiSearch.done():
+                AIMove = aiSearch.move
+                aiStats = aiSearch.stats
+                aiSearch = None
+            if AIMove is not None:
+                gs.makeMove(AIMove)
+                moveMade = True
+                animate = False
+                humanNext = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
+                if PONDER and humanNext and aiStats is not None and aiStats.depths:
+                    ponderSearch, ponderMove = startPondering(gs, aiStats.depths[-1]["pv"], AIMove)
 
         if moveMade:
             if animate:
-                animateMove(gs.moveLog[-1], screen, gs.board, clock)
+                animateMove(gs.lastMove(), screen, gs.board, clock)
+                drawn.clear()  # the animation drew over the highlights
             validMoves = gs.getValidMoves()
             moveMade = False
             animate = False
 
-        drawGameState(screen, gs, validMoves, sqSelected)
+        text = None
         if gs.checkMate:
             gameOver = True
             if gs.whiteToMove:
-                drawText(screen, 'Black wins by checkmate')
+                text = 'Black wins by checkmate'
             else:
-                drawText(screen, 'White wins by checkmate')
+                text = 'White wins by checkmate'
         elif gs.staleMate:
             gameOver = True
-            drawText(screen, 'Stalemate')
+            text = 'Stalemate'
+        if gameOver:  # nothing is left to think about, so free the engine and the core
+            if aiSearch is not None:
+                aiSearch.cancel()
+                aiSearch = None
+            if ponderSearch is not None:
+                ponderSearch.cancel()
+                ponderSearch = None
+        dirtyRects = drawGameState(screen, gs, validMoves, sqSelected, drawn, text)
 
         clock.tick(MAX_FPS)
-        p.display.flip()
+        if dirtyRects:
+            p.display.update(dirtyRects)
+    if aiSearch is not None:
+        aiSearch.cancel()
+    if ponderSearch is not None:
+        ponderSearch.cancel()
+
+
+def startPondering(gs, pv, move):
+    """
+    Start searching the position after the reply the AI expects to its move, for up to PONDER_TIME_LIMIT seconds.
+    A ponder hit replaces that limit with AI_TIME_LIMIT from the moment the reply is played
+    :param gs: the game after the AI's move
+    :param pv: the line the AI's search expected, starting with its move
+    :param move: the move the AI played
+    :return: (BackgroundSearch, the expected reply in coordinate notation), or (None, None) when there is none
+    """
+    if len(pv) < 2 or pv[0] != move.getChessNotation():
+        return None, None
+    reply = next((validMove for validMove in gs.getValidMoves() if validMove.getChessNotation() == pv[1]), None)
+    if reply is None:
+        return None, None
+    gs.makeMove(reply)
+    search = SmartMoveFinder.BackgroundSearch(SmartMoveFinder.defaultEngine, gs,
+                                              SmartMoveFinder.SearchLimits(timeLimit=PONDER_TIME_LIMIT,
+                                                                           maxDepth=SmartMoveFinder.MAX_DEPTH))
+    gs.undoMove()
+    return search, pv[1]
 
 
 def drawText(screen, text):
-    font = p.font.SysFont("Roman", 32, True, False)
-    textObject = font.render(text, 0, p.Color("Red"))
+    """
+    Draw text over the middle of the board
+    :param screen:
+    :param text:
+    :return: the rectangle drawn on
+    """
+    textObject = getFont("Roman", 32, True, False).render(text, 0, p.Color("Red"))
     textLocation = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH / 2 - textObject.get_width() / 2,
                                                     HEIGHT / 2 - textObject.get_height() / 2)
-    screen.blit(textObject, textLocation)
+    return screen.blit(textObject, textLocation)
 
 
-def highlightSquares(screen, gs, validMoves, sqSelected):
+def highlightedSquares(gs, validMoves, sqSelected):
     """
     Highlight square selected and moves for piece selected
-    :param screen:
     :param gs:
     :param validMoves:
     :param sqSelected:
-    :return:
+    :return: dict (row, col) -> 'selected' or 'target'
     """
+    highlights = {}
     if sqSelected != ():
         r, c = sqSelected
         if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'):
-            s = p.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(100)
-            s.fill(p.Color('orange'))
-            screen.blit(s, (c * SQ_SIZE, r * SQ_SIZE))
-            s.fill(p.Color('yellow'))
+            highlights[(r, c)] = 'selected'
             for move in validMoves:
                 if move.startRow == r and move.startCol == c:
-                    screen.blit(s, (move.endCol * SQ_SIZE, move.endRow * SQ_SIZE))
+                    highlights[(move.endRow, move.endCol)] = 'target'
+    return highlights
 
 
-def drawGameState(screen, gs, validMoves, sqSelected):
+def drawGameState(screen, gs, validMoves, sqSelected, drawn, text=None):
     """
-    Responsible for all the graphics within a current game state.
+    Responsible for all the graphics within a current game state. Only the squares whose piece or highlight differs
+    from what drawn says is on screen are drawn again
+    :param screen:
+    :param gs:
+    :param validMoves:
+    :param sqSelected:
+    :param drawn: (row, col) -> (piece, highlight) on screen plus the 'text' shown, kept up to date here. Clear it to
+    have everything redrawn
+    :param text: message over the board, None for none
+    :return: the rectangles drawn on, for p.display.update
     """
-    drawBoard(screen)
-    highlightSquares(screen, gs, validMoves, sqSelected)
-    drawPieces(screen, gs.board)
+    if drawn.get('text') != text:  # the squares under a message that comes or goes are all redrawn
+        drawn.clear()
+    highlights = highlightedSquares(gs, validMoves, sqSelected)
+    dirtyRects = []
+    for r in range(DIMENSION):
+        for c in range(DIMENSION):
+            square = (gs.board[r][c], highlights.get((r, c)))
+            if drawn.get((r, c)) != square:
+                rect = p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+                screen.blit(SURFACES['board'], rect, rect)
+                if square[1] is not None:
+                    screen.blit(SURFACES[square[1]], rect)
+                if square[0] != "--":
+                    screen.blit(IMAGES[square[0]], rect)
+                drawn[(r, c)] = square
+                dirtyRects.append(rect)
+    if text is not None and dirtyRects:  # squares under the message were drawn over it
+        dirtyRects.append(drawText(screen, text))
+    drawn['text'] = text
+    return dirtyRects
 
 
 def drawBoard(screen):
@@ -187,32 +317,36 @@ def drawPieces(screen, board):
 
 def animateMove(move, screen, board, clock):
     """
-    Animating moves
+    Animating moves. Each frame only restores the square-sized area the piece left and draws it at its new place
     :param move:
     :param screen:
-    :param board:
+    :param board: the board after the move
     :param clock:
     :return:
     """
-    global colors
     dR = move.endRow - move.startRow
     dC = move.endCol - move.startCol
     framePerSquare = 10  # frames to move one square
     frameCount = (abs(dR) + abs(dC)) * framePerSquare
+    # everything but the moving piece, which is erased from its ending square
+    scene = SURFACES['board'].copy()
+    drawPieces(scene, board)
+    endSquare = p.Rect(move.endCol * SQ_SIZE, move.endRow * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+    scene.blit(SURFACES['board'], endSquare, endSquare)
+    screen.blit(scene, (0, 0))
+    previous = None
     for frame in range(frameCount + 1):
         r, c = (move.startRow + dR * frame / frameCount, move.startCol + dC * frame / frameCount)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        # erase the piece moved from its ending square
-        color = colors[(move.endRow + move.endCol) % 2]
-        endSquare = p.Rect(move.endCol * SQ_SIZE, move.endRow * SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        p.draw.rect(screen, color, endSquare)
-        # draw captured piece onto rectangle
-        # if move.pieceCaptured != "--":
-        #     screen.blit(IMAGES[move.pieceMoved], endSquare)
+        pieceRect = p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        if previous is not None:
+            screen.blit(scene, previous, previous)
         # draw moving piece
-        screen.blit(IMAGES[move.pieceMoved], p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        p.display.flip()
+        screen.blit(IMAGES[move.pieceMoved], pieceRect)
+        if previous is None:
+            p.display.update(screen.get_rect())  # the whole board changed when the move was made
+        else:
+            p.display.update([previous, pieceRect])
+        previous = pieceRect
         clock.tick(60)
 
 
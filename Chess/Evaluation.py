@@ -0,0 +1,209 @@
+from Chess import ChessEngine, PieceSquareTables
+
+TOTAL_PHASE = PieceSquareTables.TOTAL_PHASE
+# the most a piece is worth in either phase, for margins that must never prune a capture that could matter
+PIECE_VALUE = {kind: max(PieceSquareTables.MG_VALUE[kind], PieceSquareTables.EG_VALUE[kind])
+               for kind in PieceSquareTables.MG_VALUE}
+# piece values for static exchange evaluation, with the king worth more than anything it could take, so an exchange
+# where the king recaptures into an attacked square is never counted as good
+EXCHANGE_VALUE = dict(PIECE_VALUE, K=20000)
+PAWN_HASH_SIZE_MB = 4  # memory budget of the pawn structure cache
+# mobility: centipawns per square a piece attacks that holds no piece of its own and no enemy pawn attacks
+MOBILITY_MG = {"N": 4, "B": 5, "R": 2, "Q": 1}
+MOBILITY_EG = {"N": 4, "B": 5, "R": 4, "Q": 2}
+# king safety, middlegame only: attack units per attacked square next to the enemy king, and the penalty the attacked
+# king gets for the sum of them, growing faster than the sum since attacks only get through together
+KING_ATTACK_UNITS = {"N": 2, "B": 2, "R": 3, "Q": 5}
+KING_ATTACK_PENALTY = (0, 0, 4, 8, 14, 22, 32, 44, 58, 74, 92, 112, 134, 158, 184, 212, 242, 274, 308, 344, 380)
+PAWN_SHIELD_BONUS = 12  # per own pawn on the three files around the king, one or two rows in front of it
+# pawn structure, from the point of view of the side owning the pawns
+DOUBLED_MG = -10  # per pawn behind another of its color on the same file
+DOUBLED_EG = -20
+ISOLATED_MG = -10  # per pawn without pawns of its color on the files next to it
+ISOLATED_EG = -15
+PASSED_MG = (0, 5, 10, 15, 25, 40, 60, 0)  # by rows advanced from the pawn's own back row
+PASSED_EG = (0, 10, 15, 30, 50, 80, 120, 0)
+
+FILES = [ChessEngine.FILE_A << col for col in range(8)]
+ADJACENT_FILES = [(FILES[col - 1] if col > 0 else 0) | (FILES[col + 1] if col < 7 else 0) for col in range(8)]
+KING_ZONES = [ChessEngine.KING_TABLE[sq] | 1 << sq for sq in range(64)]
+KNIGHT_TABLE = ChessEngine.KNIGHT_TABLE
+SLIDER_DIRECTIONS = ChessEngine.SLIDER_DIRECTIONS
+slidingAttacks = ChessEngine.slidingAttacks
+
+
+def buildFrontSpans(color, files, length=8):
+    """
+    For every square, the bitboard of the squares on files in front of it from color's point of view, white moving
+    towards row 0
+    :param color:
+    :param files: function from a column to the bitboard of the files to include
+    :param length: rows in front to include
+    :return: list of 64 bitboards
+    """
+    spans = []
+    for sq in range(64):
+        row, col = sq // 8, sq % 8
+        rows = range(max(0, row - length), row) if color == 'w' else range(row + 1, min(8, row + 1 + length))
+        spans.append(sum(ChessEngine.ROWS[r] for r in rows) & files(col))
+    return spans
+
+
+# squares that must be free of enemy pawns for a pawn to be passed, and of own pawns for it not to be doubled
+PASSED_SPANS = {color: buildFrontSpans(color, lambda col: FILES[col] | ADJACENT_FILES[col]) for color in 'wb'}
+FILE_SPANS = {color: buildFrontSpans(color, lambda col: FILES[col]) for color in 'wb'}
+PAWN_SHIELDS = {color: buildFrontSpans(color, lambda col: FILES[col] | ADJACENT_FILES[col], 2) for color in 'wb'}
+
+
+class PawnHashTable:
+    """
+    Fixed-size cache of pawn structure scores indexed by the low bits of GameState.pawnKey. Pawns move far less often
+    than pieces, so most evaluations find their pawn terms here. Entries are tuples (key, mg, eg)
+    """
+    ENTRY_BYTES = 120  # rough size of one stored entry tuple and its contents
+
+    def __init__(self, sizeMB=PAWN_HASH_SIZE_MB):
+        count = max(1, int(sizeMB * 1024 * 1024) // self.ENTRY_BYTES)
+        self.size = 1 << (count.bit_length() - 1)  # power of two, so the index is a mask of the key
+        self.mask = self.size - 1
+        self.entries = [None] * self.size
+
+    def clear(self):
+        self.entries = [None] * self.size
+
+    def probe(self, gs):
+        """
+        Pawn structure score of gs, computed and stored on a miss
+        :param gs:
+        :return: (middlegame, endgame) centipawns, positive is good for white
+        """
+        key = gs.pawnKey
+        index = key & self.mask
+        entry = self.entries[index]
+        if entry is not None and entry[0] == key:
+            return entry[1], entry[2]
+        mg, eg = pawnStructure(gs.bitboards['wp'], gs.bitboards['bp'])
+        self.entries[index] = (key, mg, eg)
+        return mg, eg
+
+
+def pawnStructure(whitePawns, blackPawns):
+    """
+    Passed, doubled and isolated pawn terms
+    :param whitePawns: bitboard
+    :param blackPawns: bitboard
+    :return: (middlegame, endgame) centipawns, positive is good for white
+    """
+    mg = eg = 0
+    for color, pawns, enemyPawns, sign in (('w', whitePawns, blackPawns, 1), ('b', blackPawns, whitePawns, -1)):
+        passedSpans = PASSED_SPANS[color]
+        fileSpans = FILE_SPANS[color]
+        remaining = pawns
+        while remaining:
+            bit = remaining & -remaining
+            remaining ^= bit
+            sq = bit.bit_length() - 1
+            if pawns & fileSpans[sq]:  # another own pawn in front on the same file
+                mg += sign * DOUBLED_MG
+                eg += sign * DOUBLED_EG
+            elif not enemyPawns & passedSpans[sq]:
+                advanced = 7 - sq // 8 if color == 'w' else sq // 8
+                mg += sign * PASSED_MG[advanced]
+                eg += sign * PASSED_EG[advanced]
+            if not pawns & ADJACENT_FILES[sq % 8]:
+                mg += sign * ISOLATED_MG
+                eg += sign * ISOLATED_EG
+    return mg, eg
+
+
+def evaluate(gs, pawnTable=None):
+    """
+    Static score of gs: material and piece-square tables, mobility, king safety and pawn structure, each scored for
+    the middlegame and the endgame and blended by the game phase, so e.g. the king leaves its corner as pieces come off
+    :param gs:
+    :param pawnTable: PawnHashTable caching the pawn structure terms, which are computed every time when left out
+    :return: centipawns, positive is good for white
+    """
+    bitboards = gs.bitboards
+    whitePawns = bitboards['wp']
+    blackPawns = bitboards['bp']
+    if pawnTable is not None:
+        mg, eg = pawnTable.probe(gs)
+    else:
+        mg, eg = pawnStructure(whitePawns, blackPawns)
+    mg += gs.mgScore
+    eg += gs.egScore
+    occupied = gs.occupied
+    # white pawns attack towards row 0, black pawns towards row 7
+    whitePawnAttacks = (whitePawns & ~ChessEngine.FILE_A) >> 9 | (whitePawns & ~ChessEngine.FILE_H) >> 7
+    blackPawnAttacks = (blackPawns & ~ChessEngine.FILE_A) << 7 | (blackPawns & ~ChessEngine.FILE_H) << 9
+    for color, enemy, enemyPawnAttacks, sign in (('w', 'b', blackPawnAttacks, 1), ('b', 'w', whitePawnAttacks, -1)):
+        available = ~(gs.occupancy[color] | enemyPawnAttacks)
+        enemyKingZone = KING_ZONES[bitboards[enemy + 'K'].bit_length() - 1]
+        attackUnits = 0
+        for kind in "NBRQ":
+            pieces = bitboards[color + kind]
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                sq = bit.bit_length() - 1
+                if kind == 'N':
+                    attacks = KNIGHT_TABLE[sq]
+                else:
+                    attacks = slidingAttacks(sq, occupied, SLIDER_DIRECTIONS[kind])
+                squares = (attacks & available).bit_count()
+                mg += sign * MOBILITY_MG[kind] * squares
+                eg += sign * MOBILITY_EG[kind] * squares
+                if attacks & enemyKingZone:
+                    attackUnits += KING_ATTACK_UNITS[kind] * (attacks & enemyKingZone).bit_count()
+        mg += sign * KING_ATTACK_PENALTY[min(attackUnits, len(KING_ATTACK_PENALTY) - 1)]
+        shield = PAWN_SHIELDS[color][bitboards[color + 'K'].bit_length() - 1] & bitboards[color + 'p']
+        mg += sign * PAWN_SHIELD_BONUS * shield.bit_count()
+    phase = min(gs.phase, TOTAL_PHASE)  # promotions can add material beyond the starting set
+    return (mg * phase + eg * (TOTAL_PHASE - phase)) // TOTAL_PHASE
+
+
+def staticExchange(gs, move):
+    """
+    Material the side to move wins or loses with a capture once the exchange on the target square is played out: both
+    sides keep recapturing with their least valuable attacker, sliders behind the pieces that leave the square's lines
+    joining in, and either side may stop when going on would lose more
+    :param gs:
+    :param move: move code of a capture or promotion
+    :return: centipawns, negative when the capture loses material
+    """
+    bitboards = gs.bitboards
+    board = gs.board
+    startSq = move & 63
+    endSq = move >> 6 & 63
+    flag = move >> 12 & 3
+    occupied = gs.occupied ^ 1 << startSq
+    onSquare = EXCHANGE_VALUE[board[startSq // 8][startSq % 8][1]]  # what the next capture on endSq takes
+    if flag == ChessEngine.ENPASSANT_MOVE:
+        gain = EXCHANGE_VALUE['p']
+        occupied ^= 1 << (startSq // 8 * 8 + endSq % 8)
+    else:
+        captured = board[endSq // 8][endSq % 8]
+        gain = EXCHANGE_VALUE[captured[1]] if captured != '--' else 0
+    if flag == ChessEngine.PROMOTION_MOVE:
+        promotionValue = EXCHANGE_VALUE[ChessEngine.PROMOTION_PIECES[move >> 14]]
+        gain += promotionValue - EXCHANGE_VALUE['p']
+        onSquare = promotionValue
+    gains = [gain]
+    color = 'b' if gs.whiteToMove else 'w'
+    while True:
+        attackers = gs.attackersTo(endSq, color, occupied) & occupied
+        if not attackers:
+            break
+        for kind in "pNBRQK":  # least valuable attacker first
+            pieces = bitboards[color + kind] & attackers
+            if pieces:
+                break
+        gains.append(onSquare - gains[-1])  # score of the side capturing now, if the exchange stopped here
+        onSquare = EXCHANGE_VALUE[kind]
+        occupied ^= pieces & -pieces
+        color = 'w' if color == 'b' else 'b'
+    # each side only makes its capture when it does better than stopping before it
+    for i in range(len(gains) - 1, 0, -1):
+        gains[i - 1] = -max(-gains[i - 1], gains[i])
+    return gains[0]
@@ -0,0 +1,102 @@
+import mmap
+import os
+import random
+import struct
+
+# one book entry: Zobrist key of the position, packed move code, weight. Entries are sorted by key
+ENTRY = struct.Struct(">QHH")
+KEY = struct.Struct(">Q")
+MAX_WEIGHT = 0xFFFF
+DEFAULT_BOOK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Books", "book.bin")
+
+
+class OpeningBook:
+    """
+    Opening book file of fixed size entries sorted by position key. The file is memory-mapped and searched in place,
+    so opening a book costs nothing however large it is
+    """
+
+    def __init__(self, path=DEFAULT_BOOK):
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size % ENTRY.size != 0:
+            self.file.close()
+            raise ValueError("Not an opening book, its size is not a multiple of %d bytes: %s" % (ENTRY.size, path))
+        self.count = size // ENTRY.size
+        # an empty file cannot be mapped, but it is a valid book without entries
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b""
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    def probe(self, key):
+        """
+        Binary search for the entries of a position
+        :param key: Zobrist key of the position
+        :return: list of (move code, weight)
+        """
+        lo = 0
+        hi = self.count
+        while lo < hi:  # first entry with a key not below key
+            mid = (lo + hi) // 2
+            if KEY.unpack_from(self.data, mid * ENTRY.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        entries = []
+        for i in range(lo, self.count):
+            entryKey, code, weight = ENTRY.unpack_from(self.data, i * ENTRY.size)
+            if entryKey != key:
+                break
+            entries.append((code, weight))
+        return entries
+
+    def chooseMove(self, gs, validMoves=None, rng=random):
+        """
+        Pick a book move for the side to move, each move with a chance in proportion to its weight
+        :param gs:
+        :param validMoves: the legal moves of gs, generated when left out
+        :param rng: random.Random to draw from
+        :return: the Move, or None when the position is not in the book
+        """
+        if self.count == 0:
+            return None
+        if validMoves is None:
+            validMoves = gs.getValidMoves()
+        movesByCode = {move.code: move for move in validMoves}
+        # a different position sharing the key could suggest a move that is illegal here
+        entries = [(movesByCode[code], weight) for code, weight in self.probe(gs.zobristKey)
+                   if code in movesByCode and weight > 0]
+        if len(entries) == 0:
+            return None
+        return rng.choices([move for move, weight in entries], [weight for move, weight in entries])[0]
+
+
+def openBook(path=DEFAULT_BOOK):
+    """
+    Open the book at path if there is one
+    :param path:
+    :return: the OpeningBook, or None when the file does not exist
+    """
+    if path is None or not os.path.exists(path):
+        return None
+    return OpeningBook(path)
+
+
+def writeBook(entries, path):
+    """
+    Write a book file
+    :param entries: dict from (key, move code) to weight
+    :param path:
+    :return: number of entries written
+    """
+    scale = max(1, (max(entries.values(), default=0) + MAX_WEIGHT - 1) // MAX_WEIGHT)  # weights must fit 16 bits
+    written = 0
+    with open(path, "wb") as f:
+        for (key, code), weight in sorted(entries.items()):
+            weight = max(1, weight // scale)
+            f.write(ENTRY.pack(key, code, weight))
+            written += 1
+    return written
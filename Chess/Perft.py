@@ -0,0 +1,115 @@
+import argparse
+import sys
+import time
+from Chess import ChessEngine
+
+# standard perft positions with their published leaf counts for depth 1, 2, 3...
+POSITIONS = [
+    ("start", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+     [20, 400, 8902, 197281, 4865609, 119060324]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603, 193690690]),
+    ("endgame en passant", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624, 11030083]),
+    ("promotions", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333, 15833292]),
+    ("promotions mirrored", "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+     [6, 264, 9467, 422333, 15833292]),
+    ("castling checks", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487, 89941194]),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594, 164075551]),
+]
+SUITE_DEPTH = 3  # deep enough to cover castling, en passant and promotion in every position, quick enough to run often
+
+
+def perft(gs, depth):
+    """
+    Count the leaf nodes of the legal move tree to depth
+    :param gs:
+    :param depth:
+    :return:
+    """
+    if depth == 0:
+        return 1
+    moves = gs.getValidMoveCodes()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMoveCode(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+def divide(gs, depth):
+    """
+    Perft split by root move, for finding which move a generator bug hides under
+    :param gs:
+    :param depth:
+    :return: list of (move notation, leaf nodes)
+    """
+    results = []
+    for move in gs.getValidMoveCodes():
+        notation = gs.getMove(move).getChessNotation()
+        gs.makeMoveCode(move)
+        results.append((notation, perft(gs, depth - 1)))
+        gs.undoMove()
+    return results
+
+
+def runSuite(depth=SUITE_DEPTH, positions=POSITIONS, out=print):
+    """
+    Run perft on every position up to depth and compare with the known counts
+    :param depth:
+    :param positions:
+    :param out:
+    :return: True when every count matched
+    """
+    passed = True
+    totalNodes = 0
+    totalTime = 0
+    for name, fen, counts in positions:
+        gs = ChessEngine.GameState.fromFEN(fen)
+        for d in range(1, min(depth, len(counts)) + 1):
+            startTime = time.perf_counter()
+            nodes = perft(gs, d)
+            elapsed = time.perf_counter() - startTime
+            totalNodes += nodes
+            totalTime += elapsed
+            ok = nodes == counts[d - 1]
+            passed = passed and ok
+            out("%-20s depth %d  %10d nodes  %s  %8.0f nps" % (name, d, nodes, "ok" if ok else
+                                                               "FAIL (expected %d)" % counts[d - 1],
+                                                               nodes / elapsed if elapsed else 0))
+    out("%d nodes in %.2f s, %.0f nps, %s" % (totalNodes, totalTime, totalNodes / totalTime if totalTime else 0,
+                                             "all passed" if passed else "FAILED"))
+    return passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count move generator leaf nodes (perft) to validate and benchmark "
+                                                 "GameState")
+    parser.add_argument("--fen", help="position to count, runs the standard suite when left out")
+    parser.add_argument("--depth", type=int, default=SUITE_DEPTH)
+    parser.add_argument("--divide", action="store_true", help="print the count under every root move")
+    args = parser.parse_args(argv)
+    if args.fen is None:
+        return 0 if runSuite(args.depth) else 1
+    gs = ChessEngine.GameState.fromFEN(args.fen)
+    startTime = time.perf_counter()
+    if args.divide:
+        results = divide(gs, args.depth)
+        for notation, nodes in results:
+            print(notation + ": " + str(nodes))
+        nodes = sum(nodes for notation, nodes in results)
+    else:
+        nodes = perft(gs, args.depth)
+    elapsed = time.perf_counter() - startTime
+    print("%d nodes in %.2f s, %.0f nps" % (nodes, elapsed, nodes / elapsed if elapsed else 0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+# Piece values and piece-square tables in centipawns, separately for the middlegame and the endgame. The tables are
+# written from white's point of view with rank 8 on the first line, which is the square order of GameState, so a
+# white piece on sq reads table[sq] and a black piece reads table[sq ^ 56], its mirror across the middle of the board
+MG_VALUE = {"p": 100, "N": 320, "B": 330, "R": 500, "Q": 950, "K": 0}
+EG_VALUE = {"p": 120, "N": 300, "B": 320, "R": 530, "Q": 980, "K": 0}
+# how much each piece counts towards the game phase, 24 with all pieces on the board and 0 with only kings and pawns
+PHASE_WEIGHT = {"p": 0, "N": 1, "B": 1, "R": 2, "Q": 4, "K": 0}
+TOTAL_PHASE = 24
+
+PAWN_MG = (
+    0, 0, 0, 0, 0, 0, 0, 0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+    5, 5, 10, 25, 25, 10, 5, 5,
+    0, 0, 0, 20, 20, 0, 0, 0,
+    5, -5, -10, 0, 0, -10, -5, 5,
+    5, 10, 10, -20, -20, 10, 10, 5,
+    0, 0, 0, 0, 0, 0, 0, 0)
+PAWN_EG = (
+    0, 0, 0, 0, 0, 0, 0, 0,
+    60, 60, 60, 60, 60, 60, 60, 60,
+    35, 35, 35, 35, 35, 35, 35, 35,
+    20, 20, 20, 20, 20, 20, 20, 20,
+    10, 10, 10, 10, 10, 10, 10, 10,
+    5, 5, 5, 5, 5, 5, 5, 5,
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0)
+KNIGHT = (
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20, 0, 0, 0, 0, -20, -40,
+    -30, 0, 10, 15, 15, 10, 0, -30,
+    -30, 5, 15, 20, 20, 15, 5, -30,
+    -30, 0, 15, 20, 20, 15, 0, -30,
+    -30, 5, 10, 15, 15, 10, 5, -30,
+    -40, -20, 0, 5, 5, 0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50)
+BISHOP = (
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 10, 10, 5, 0, -10,
+    -10, 5, 5, 10, 10, 5, 5, -10,
+    -10, 0, 10, 10, 10, 10, 0, -10,
+    -10, 10, 10, 10, 10, 10, 10, -10,
+    -10, 5, 0, 0, 0, 0, 5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20)
+ROOK_MG = (
+    0, 0, 0, 0, 0, 0, 0, 0,
+    5, 10, 10, 10, 10, 10, 10, 5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    0, 0, 0, 5, 5, 0, 0, 0)
+ROOK_EG = (
+    5, 5, 5, 5, 5, 5, 5, 5,
+    10, 10, 10, 10, 10, 10, 10, 10,
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0)
+QUEEN = (
+    -20, -10, -10, -5, -5, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 5, 5, 5, 0, -10,
+    -5, 0, 5, 5, 5, 5, 0, -5,
+    0, 0, 5, 5, 5, 5, 0, -5,
+    -10, 5, 5, 5, 5, 5, 0, -10,
+    -10, 0, 5, 0, 0, 0, 0, -10,
+    -20, -10, -10, -5, -5, -10, -10, -20)
+KING_MG = (  # behind the pawns in a corner while there are pieces to attack it
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+    20, 20, 0, 0, 0, 0, 20, 20,
+    20, 30, 10, 0, 0, 10, 30, 20)
+KING_EG = (  # in the centre once the pieces are gone
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10, 0, 0, -10, -20, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -30, 0, 0, 0, 0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50)
+MG_TABLES = {"p": PAWN_MG, "N": KNIGHT, "B": BISHOP, "R": ROOK_MG, "Q": QUEEN, "K": KING_MG}
+EG_TABLES = {"p": PAWN_EG, "N": KNIGHT, "B": BISHOP, "R": ROOK_EG, "Q": QUEEN, "K": KING_EG}
+
+
+def buildScores(values, tables):
+    """
+    Value plus table bonus of every piece on every square, from white's point of view, so black pieces score negative
+    :param values: MG_VALUE or EG_VALUE
+    :param tables: MG_TABLES or EG_TABLES
+    :return: dict piece -> list of 64 scores
+    """
+    scores = {}
+    for color, sign, flip in (('w', 1, 0), ('b', -1, 56)):
+        for kind, table in tables.items():
+            scores[color + kind] = [sign * (values[kind] + table[sq ^ flip]) for sq in range(64)]
+    return scores
+
+
+MG_SCORES = buildScores(MG_VALUE, MG_TABLES)
+EG_SCORES = buildScores(EG_VALUE, EG_TABLES)
+PHASE = {color + kind: weight for color in 'wb' for kind, weight in PHASE_WEIGHT.items()}
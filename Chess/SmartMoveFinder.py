@@ -1,10 +1,156 @@
+import concurrent.futures
+import copy
+import itertools
 import random
+import threading
+import time
+from Chess import ChessEngine, Evaluation, Tablebase
 
-pieceScore = {"K": 0, "Q": 10, "R": 5, "N": 3, "B": 3, "p": 1}
-CHECKMATE = 1000
+pieceScore = ChessEngine.pieceScore
+CHECKMATE = 100000  # scores are in centipawns, being mated ply half moves below the root scores ply - CHECKMATE
 STALEMATE = 0
+# a table win scores this less its plies to mate from the root, below any mate the search finds and above any material
+TABLEBASE_WIN = CHECKMATE - 1000
+# scores beyond this count plies to a mate from the root, so the transposition table stores them relative to the node
+WIN_BOUND = TABLEBASE_WIN - 1000
 DEPTH = 5
-nextMove = None
+MAX_DEPTH = 64  # deepest iteration the iterative deepening driver will try
+nextMove = None  # result of the legacy findMoveMinMax and findMoveNegaMax, SearchEngine keeps its own
+BUDGET_CHECK_INTERVAL = 64  # nodes between budget checks, a few milliseconds at this engine's speed
+processPools = {}  # worker count -> process pool, each created on the first parallel search with that many workers
+processPoolLock = threading.Lock()
+PARALLEL_MIN_DEPTH = 3  # shallower depths finish faster than their root moves could be handed to the workers
+searchIds = itertools.count(1)  # tells a worker process that a task belongs to a new search
+DELTA_MARGIN = 200  # a capture that cannot lift the score to within this of alpha is skipped in quiescence
+NULL_MOVE_MIN_DEPTH = 3
+NULL_MOVE_REDUCTION = 2  # depth taken off the null-move search on top of the passed turn
+LMR_MIN_DEPTH = 3
+LMR_FULL_DEPTH_MOVES = 3  # moves searched at full depth before late quiet moves are reduced
+TT_SIZE_MB = 64  # memory budget of the transposition table
+EXACT = 0
+LOWERBOUND = 1  # the search failed high, score is at least this
+UPPERBOUND = 2  # the search failed low, score is at most this
+
+# move ordering: hash move, then captures that do not lose material by MVV-LVA, then killer moves, then quiet moves by
+# history score, then the losing captures
+HASH_MOVE_SCORE = 1000000
+CAPTURE_SCORE = 100000
+KILLER_SCORES = (90000, 80000)
+orderingValue = {"K": 20, "Q": 9, "R": 5, "B": 3, "N": 3, "p": 1}
+
+
+class TranspositionTable:
+    """
+    Fixed-size hash table of searched positions, indexed by the low bits of GameState.zobristKey.
+    Entries are tuples (key, depth, flag, score, bestMove, age). A slot is overwritten by a deeper search,
+    by the same position, or when its entry was left over from an earlier search.
+    """
+    ENTRY_BYTES = 160  # rough size of one stored entry tuple and its contents
+
+    def __init__(self, sizeMB=TT_SIZE_MB):
+        self.size = 0
+        self.mask = 0
+        self.entries = []
+        self.age = 0
+        self.resize(sizeMB)
+
+    def resize(self, sizeMB):
+        """
+        Reallocate the table to fit in sizeMB megabytes, dropping every entry
+        :param sizeMB:
+        :return:
+        """
+        count = max(1, int(sizeMB * 1024 * 1024) // self.ENTRY_BYTES)
+        self.size = 1 << (count.bit_length() - 1)  # power of two, so the index is a mask of the key
+        self.mask = self.size - 1
+        self.clear()
+
+    def clear(self):
+        self.entries = [None] * self.size
+        self.age = 0
+
+    def newSearch(self):
+        """
+        Called once per root search so entries from earlier searches become preferred victims
+        :return:
+        """
+        self.age += 1
+
+    def probe(self, key):
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, flag, score, bestMove):
+        index = key & self.mask
+        entry = self.entries[index]
+        if entry is None or entry[0] == key or entry[5] != self.age or depth >= entry[1]:
+            self.entries[index] = (key, depth, flag, score, bestMove, self.age)
+
+
+class SearchStats:
+    """
+    Counters of one search: node counts, pruning effectiveness, and a record for every depth that finished.
+    SearchEngine.stats holds the stats of its running or last search
+    """
+
+    def __init__(self):
+        self.nodes = 0  # alpha-beta nodes
+        self.qnodes = 0  # quiescence nodes
+        self.cutoffs = 0  # beta cutoffs
+        self.firstMoveCutoffs = 0  # beta cutoffs caused by the first move searched, a measure of move ordering
+        self.ttProbes = 0
+        self.ttHits = 0
+        self.tbHits = 0  # positions answered by the endgame tables
+        self.seldepth = 0  # deepest ply below the root reached, quiescence included
+        self.elapsed = 0  # seconds
+        # for every finished depth: {"depth", "score", "move", "pv", "time", "nodes", "seldepth"}, where time is
+        # seconds since the start, nodes includes qnodes and pv is the expected line in coordinate notation
+        self.depths = []
+
+    def nps(self):
+        return (self.nodes + self.qnodes) / self.elapsed if self.elapsed > 0 else 0
+
+    def firstMoveCutoffRate(self):
+        return self.firstMoveCutoffs / self.cutoffs if self.cutoffs else 0
+
+    def ttHitRate(self):
+        return self.ttHits / self.ttProbes if self.ttProbes else 0
+
+    def add(self, other):
+        """
+        Add the counters of another search, e.g. a worker of a parallel search, to these
+        :param other:
+        :return:
+        """
+        self.nodes += other.nodes
+        self.qnodes += other.qnodes
+        self.cutoffs += other.cutoffs
+        self.firstMoveCutoffs += other.firstMoveCutoffs
+        self.ttProbes += other.ttProbes
+        self.ttHits += other.ttHits
+        self.tbHits += other.tbHits
+        self.seldepth = max(self.seldepth, other.seldepth)
+        self.elapsed = max(self.elapsed, other.elapsed)
+
+    def summary(self):
+        """
+        The stats as a plain dict, for logging or JSON
+        :return:
+        """
+        return {"nodes": self.nodes, "qnodes": self.qnodes, "nps": round(self.nps()), "time": round(self.elapsed, 3),
+                "depth": self.depths[-1]["depth"] if self.depths else 0, "seldepth": self.seldepth,
+                "firstMoveCutoffRate": round(self.firstMoveCutoffRate(), 3), "ttHitRate": round(self.ttHitRate(), 3),
+                "tbHits": self.tbHits,
+                "pv": self.depths[-1]["pv"] if self.depths else [], "depths": self.depths}
+
+
+class SearchTimeout(Exception):
+    """
+    Raised from inside the search when the time or node budget runs out
+    """
+    pass
 
 
 def findRandomMove(validMoves):
@@ -43,7 +189,7 @@ def findBestMove(gs, validMoves):
                 elif gs.staleMate:
                     score = STALEMATE
                 else:
-                    score = -turnMultiplier * scoreMaterial(gs.board)
+                    score = -turnMultiplier * gs.materialScore
                 if score > opponentMaxScore:
                     opponentMaxScore = score
                 gs.undoMove()
@@ -54,27 +200,804 @@ def findBestMove(gs, validMoves):
     return bestPlayerMove
 
 
+class SearchLimits:
+    """
+    What a search may spend. Without a time or node limit the search stops at DEPTH unless maxDepth says otherwise.
+    Setting stopEvent, a threading.Event, from another thread ends the search like a used up budget. A search split
+    across worker processes only notices it once the workers are done with their depth
+    """
+
+    def __init__(self, timeLimit=None, nodeLimit=None, maxDepth=None, workers=1, stopEvent=None):
+        self.timeLimit = timeLimit  # seconds
+        self.nodeLimit = nodeLimit
+        self.maxDepth = maxDepth
+        self.workers = workers  # processes the root moves are split across
+        self.stopEvent = stopEvent
+
+
+class SearchEngine:
+    """
+    Iterative deepening alpha-beta searcher owning its transposition table, move ordering tables, limits and stats,
+    so many games can be searched in one process. Different engines can search from different threads at the same
+    time; overlapping calls to search on one engine wait for each other. The engine searches its own copy of the
+    game state, so the caller's GameState is never changed
+    """
+
+    def __init__(self, ttSizeMB=TT_SIZE_MB, tablebaseDir=Tablebase.TABLEBASE_DIR):
+        self.transpositionTable = TranspositionTable(ttSizeMB)
+        self.tablebases = Tablebase.Tablebases(tablebaseDir)  # no tables when the directory does not exist
+        self.pawnTable = Evaluation.PawnHashTable()
+        self.killerMoves = [[None, None] for ply in range(MAX_DEPTH + 1)]
+        self.historyTable = {piece: [0] * 64 for piece in ChessEngine.PIECES}
+        self.limits = SearchLimits()
+        self.stats = SearchStats()
+        self.lock = threading.Lock()
+        # state of the running search
+        self.nextMove = None  # best move code found so far at the root of the current iteration
+        self.nextScore = None  # score of nextMove, a lower bound until the iteration is done
+        self.searchId = None  # number of the running search, for a worker process to notice a new one
+        self.rootPly = 0  # length of the move log at the root, to tell how far below the root a node is
+        self.nodeCount = 0
+        self.deadline = None  # perf_counter() time at which the search must stop, None for no time limit
+        self.nodeLimit = None
+        self.nextBudgetCheck = 0  # node count at which the budget is checked next
+        self.stopEvent = None
+        self.timeLimit = None  # seconds from budgetStart
+        self.budgetStart = 0  # perf_counter() time the time limit counts from, moved by ponderhit
+        self.budgetActive = False  # whether the first depth is done, before that a scored root move must exist too
+        self.budgetLock = threading.Lock()  # ponderhit changes the budget from another thread
+
+    def search(self, gs, limits=None, validMoves=None, progress=None):
+        """
+        Find the best move for the side to move in gs
+        :param gs:
+        :param limits: SearchLimits, depth DEPTH when left out
+        :param validMoves: the root moves to choose from, all legal moves when left out
+        :param progress: called with the SearchStats after every finished depth
+        :return: (best Move or None when there is no legal move, SearchStats)
+        """
+        with self.lock:
+            gs = copy.deepcopy(gs)
+            self.limits = limits if limits is not None else SearchLimits()
+            if validMoves is None:
+                validMoves = gs.getValidMoves()
+            if len(validMoves) == 0:
+                self.stats = SearchStats()
+                return None, self.stats
+            tablebaseMove = self.probeRoot(gs, validMoves, progress)
+            if tablebaseMove is not None:
+                return tablebaseMove, self.stats
+            timeLimit = self.limits.timeLimit
+            nodeLimit = self.limits.nodeLimit
+            maxDepth = self.limits.maxDepth
+            if maxDepth is None:
+                maxDepth = DEPTH if timeLimit is None and nodeLimit is None else MAX_DEPTH
+            validMoves = list(validMoves)
+            random.shuffle(validMoves)
+            movesByCode = {move.code: move for move in validMoves}  # the search works on the packed codes
+            rootMoves = list(movesByCode)
+            bestMove = self.searchIterative(gs, rootMoves, timeLimit, nodeLimit, maxDepth, progress,
+                                            self.limits.workers)[-1][2]
+            return movesByCode[bestMove], self.stats
+
+    def probeRoot(self, gs, validMoves, progress=None):
+        """
+        Pick the move straight from the endgame tables when they cover the position and every move from it: the
+        fastest win, else a draw, else the slowest loss
+        :param gs:
+        :param validMoves:
+        :param progress:
+        :return: the Move, or None when the position has to be searched
+        """
+        if gs.occupied.bit_count() > self.tablebases.maxPieces or self.tablebases.probe(gs) is None:
+            return None
+        startTime = time.perf_counter()
+        bestMove = None
+        bestScore = -CHECKMATE
+        for move in validMoves:
+            gs.makeMove(move)
+            try:
+                value = self.tablebases.probe(gs)
+            finally:
+                gs.undoMove()
+            if value is None:  # e.g. an en passant capture becomes possible
+                return None
+            score = -tablebaseScore(value, 1)
+            if bestMove is None or score > bestScore:
+                bestMove = move
+                bestScore = score
+        self.stats = SearchStats()
+        self.stats.tbHits = len(validMoves)
+        self.stats.elapsed = time.perf_counter() - startTime
+        self.stats.depths.append({"depth": 1, "score": bestScore, "move": bestMove.getChessNotation(),
+                                  "pv": [bestMove.getChessNotation()], "time": round(self.stats.elapsed, 3),
+                                  "nodes": 0, "seldepth": 1})
+        if progress is not None:
+            progress(self.stats)
+        return bestMove
+
+    def searchIterative(self, gs, validMoves, timeLimit, nodeLimit, maxDepth, progress=None, workers=1):
+        """
+        Iterative deepening: search depth 1, 2, 3... until the time (seconds) or node budget runs out. The budget can
+        only cut depth 1 short once a root move has a score, and then the best move scored so far is kept, so a move
+        is found whenever one exists
+        :param gs:
+        :param validMoves: move codes
+        :param timeLimit:
+        :param nodeLimit:
+        :param maxDepth:
+        :param progress: called with the stats after every finished depth
+        :param workers: processes every depth from PARALLEL_MIN_DEPTH on is split across, see searchSplitDepth
+        :return: (depth, score, best move code) for every depth that finished, score from the side to move's point of
+        view
+        """
+        startTime = time.perf_counter()
+        self.transpositionTable.newSearch()
+        self.clearMoveOrdering()
+        bestMove = validMoves[0]
+        self.startSearch(nodeLimit=nodeLimit, rootPly=len(gs.moveRecords))
+        self.searchId = next(searchIds)
+        with self.budgetLock:  # ponderhit changes these from another thread
+            self.timeLimit = timeLimit
+            self.budgetStart = startTime
+            self.deadline = None if timeLimit is None else startTime + timeLimit
+        self.stopEvent = self.limits.stopEvent
+        stats = self.stats
+        turnMultiplier = 1 if gs.whiteToMove else -1
+        completed = []
+        for depth in range(1, maxDepth + 1):
+            self.nextMove = None
+            pv = None
+            try:
+                if workers > 1 and depth >= PARALLEL_MIN_DEPTH and len(validMoves) > 1:
+                    score, pv = self.searchSplitDepth(gs, validMoves, depth, turnMultiplier, workers)
+                else:
+                    score = self.findMoveNegaMaxAlphaBeta(gs, validMoves, depth, -CHECKMATE, CHECKMATE,
+                                                          turnMultiplier)
+            except SearchTimeout:  # every move the aborted search made was taken back as the exception passed through
+                if depth > 1:
+                    break
+                score = self.nextScore  # depth 1 cut short, play the best of the root moves it scored
+            if self.nextMove is not None:
+                bestMove = self.nextMove  # stored as the hash move of the root, so the next depth searches it first
+            if pv is None:
+                pv = self.principalVariation(gs, bestMove, depth)
+            completed.append((depth, score, bestMove))
+            elapsed = time.perf_counter() - startTime
+            stats.elapsed = elapsed
+            stats.depths.append({"depth": depth, "score": score, "move": gs.getMove(bestMove).getChessNotation(),
+                                 "pv": pv, "time": round(elapsed, 3),
+                                 "nodes": stats.nodes + stats.qnodes, "seldepth": stats.seldepth})
+            if progress is not None:
+                progress(stats)
+            self.budgetActive = True
+            if self.stopEvent is not None and self.stopEvent.is_set():
+                break
+            if nodeLimit is not None and self.nodeCount >= nodeLimit:
+                break
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                break
+            if abs(score) > TABLEBASE_WIN:  # the shortest forced mate was found, searching deeper cannot change it
+                break
+            timeLimit = self.timeLimit
+            if timeLimit is not None and time.perf_counter() - self.budgetStart > timeLimit / 2:
+                break  # the next depth would not finish in time
+        stats.elapsed = time.perf_counter() - startTime
+        return completed
+
+    def searchSplitDepth(self, gs, validMoves, depth, turnMultiplier, workers, ply=0):
+        """
+        One depth of the search split across a process pool, young brothers wait style: the first move, the hash move
+        from the previous depth, is searched here, split the same way one ply further down while deep enough, and only
+        then are the other moves split round-robin across the workers with its score as alpha. Each worker searches its
+        moves with a null window on the best score it knows and re-searches the ones that fail high, so moves worse
+        than the first one are refuted as cheaply as in a serial search. The highest score wins, ties going to the
+        move that comes first in validMoves, so the same worker results always give the same move. Only the leftmost
+        line is split, where the window is still full
+        :param gs:
+        :param validMoves: legal move codes of gs, sorted in place like findMoveNegaMaxAlphaBeta sorts the root moves
+        :param depth:
+        :param turnMultiplier:
+        :param workers:
+        :param ply: distance from the root in half moves
+        :return: (score from the side to move's point of view, expected line when a worker found a move on it and
+        None when the line is in this engine's transposition table)
+        """
+        key = gs.zobristKey
+        entry = self.transpositionTable.probe(key)
+        self.orderMoves(gs, validMoves, None if entry is None else entry[4], ply)
+        firstMove = validMoves[0]
+        gs.makeMoveCode(firstMove)
+        try:
+            replies = gs.getValidMoveCodes() if depth > PARALLEL_MIN_DEPTH else []
+            if len(replies) > 1:
+                score, pv = self.searchSplitDepth(gs, replies, depth - 1, -turnMultiplier, workers, ply + 1)
+            else:
+                score = self.findMoveNegaMaxAlphaBeta(gs, None, depth - 1, -CHECKMATE, CHECKMATE, -turnMultiplier,
+                                                      ply + 1)
+                pv = None
+        finally:
+            gs.undoMove()
+        bestScore = alpha = -score
+        bestMove = firstMove
+        bestPV = None if pv is None else [gs.getMove(firstMove).getChessNotation()] + pv
+        otherMoves = validMoves[1:]
+        if otherMoves:
+            workers = min(workers, len(otherMoves))
+            # the workers share what is left of the budget, which they cannot be told about once they have started
+            timeLimit = None if self.deadline is None else max(0, self.deadline - time.perf_counter())
+            nodeLimit = None if self.nodeLimit is None else max(1, (self.nodeLimit - self.nodeCount) // workers)
+            pool = getProcessPool(workers)
+            futures = [pool.submit(searchRootMoves, gs, otherMoves[i::workers], depth, alpha, ply, self.searchId,
+                                   timeLimit, nodeLimit) for i in range(workers)]
+            results = [future.result() for future in futures]
+            for score, move, pv, workerStats in results:
+                self.stats.add(workerStats)
+                self.nodeCount += workerStats.nodes + workerStats.qnodes
+            if any(score is None for score, move, pv, workerStats in results):
+                raise SearchTimeout()
+            moveOrder = {move: i for i, move in enumerate(validMoves)}
+            candidates = [(score, -moveOrder[move], pv) for score, move, pv, workerStats in results if move is not None]
+            if candidates:
+                score, index, pv = max(candidates)
+                if score > alpha:
+                    bestScore, bestMove, bestPV = score, validMoves[-index], pv
+        if ply == 0:
+            self.nextMove = bestMove
+        self.transpositionTable.store(key, depth, EXACT, scoreToTable(bestScore, ply), bestMove)
+        return bestScore, bestPV
+
+    def searchMoves(self, gs, validMoves, depth, alpha, ply, searchId, timeLimit, nodeLimit):
+        """
+        A worker's share of searchSplitDepth: search some of the moves of a node to depth, looking only for scores
+        above alpha. The transposition table and move ordering tables are kept from one task to the next of the same
+        search
+        :param gs:
+        :param validMoves: move codes
+        :param depth:
+        :param alpha: score of the move of the node searched first
+        :param ply: distance of the node from the root in half moves
+        :param searchId: searchId of the engine splitting its search
+        :param timeLimit: seconds
+        :param nodeLimit:
+        :return: (score, move code, expected line) of the best move when it scores above alpha, (score, None, None)
+        when none does and (None, None, None) when the budget ran out first
+        """
+        if searchId != self.searchId:
+            self.searchId = searchId
+            self.transpositionTable.newSearch()
+            self.clearMoveOrdering()
+        self.startSearch(timeLimit, nodeLimit, len(gs.moveRecords) - ply)
+        self.budgetActive = True
+        self.nextMove = None
+        turnMultiplier = 1 if gs.whiteToMove else -1
+        try:
+            score = self.findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, CHECKMATE, turnMultiplier, ply)
+        except SearchTimeout:
+            return None, None, None
+        if score <= alpha:
+            return score, None, None
+        return score, self.nextMove, self.principalVariation(gs, self.nextMove, depth)
+
+    def principalVariation(self, gs, firstMove, maxLength):
+        """
+        Read back the line the search expects by following the hash moves from the root
+        :param gs:
+        :param firstMove: move code
+        :param maxLength:
+        :return: the moves in coordinate notation
+        """
+        pv = []
+        seen = set()  # a repetition would otherwise loop forever
+        move = firstMove
+        while move is not None and len(pv) < maxLength and gs.zobristKey not in seen:
+            seen.add(gs.zobristKey)
+            pv.append(gs.getMove(move).getChessNotation())
+            gs.makeMoveCode(move)
+            entry = self.transpositionTable.probe(gs.zobristKey)
+            move = None
+            if entry is not None and entry[4] is not None:
+                gs.prepareMoveGeneration()
+                if gs.isLegalMoveCode(entry[4]):  # the entry may come from a different position sharing the key
+                    move = entry[4]
+        for i in range(len(pv)):
+            gs.undoMove()
+        return pv
+
+    def startSearch(self, timeLimit=None, nodeLimit=None, rootPly=0):
+        """
+        Reset the node counter and stats and set the budget for a new search
+        :param timeLimit:
+        :param nodeLimit:
+        :param rootPly: length of the move log at the root
+        :return:
+        """
+        self.nodeCount = 0
+        self.rootPly = rootPly
+        self.stats = SearchStats()
+        self.deadline = None if timeLimit is None else time.perf_counter() + timeLimit
+        self.nodeLimit = nodeLimit
+        self.stopEvent = None
+        self.budgetActive = False
+        self.nextBudgetCheck = BUDGET_CHECK_INTERVAL if nodeLimit is None else min(BUDGET_CHECK_INTERVAL, nodeLimit)
+
+    def ponderhit(self, timeLimit=None, hitTime=None):
+        """
+        The move a ponder search guessed was played. The search, started without a time limit on the position after
+        that move, keeps everything it found and from now on has timeLimit seconds
+        :param timeLimit: None to search on until stopped
+        :param hitTime: perf_counter() time the move was played, now when left out
+        :return:
+        """
+        with self.budgetLock:
+            self.budgetStart = time.perf_counter() if hitTime is None else hitTime
+            self.timeLimit = timeLimit
+            self.deadline = None if timeLimit is None else self.budgetStart + timeLimit
+
+    def checkBudget(self):
+        """
+        Raise SearchTimeout once the node or time budget is used up, otherwise schedule the next check. Nothing is
+        raised while depth 1 has not scored a root move yet, there would be no move to play
+        :return:
+        """
+        if not self.budgetActive and self.nextMove is None:
+            self.nextBudgetCheck = self.nodeCount + BUDGET_CHECK_INTERVAL
+            return
+        if self.nodeLimit is not None and self.nodeCount >= self.nodeLimit:
+            raise SearchTimeout()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchTimeout()
+        if self.stopEvent is not None and self.stopEvent.is_set():
+            raise SearchTimeout()
+        self.nextBudgetCheck = self.nodeCount + BUDGET_CHECK_INTERVAL
+        if self.nodeLimit is not None:
+            self.nextBudgetCheck = min(self.nextBudgetCheck, self.nodeLimit)
+
+    def clearMoveOrdering(self):
+        """
+        Forget the killer moves and history scores of the previous search
+        :return:
+        """
+        for killers in self.killerMoves:
+            killers[0] = killers[1] = None
+        for scores in self.historyTable.values():
+            for i in range(64):
+                scores[i] = 0
+
+    def orderMoves(self, gs, moves, hashMove, ply):
+        """
+        Sort move codes in place so the likeliest cutoffs come first: the hash move, captures that do not lose material
+        ranked by most valuable victim / least valuable attacker, the killer moves of this ply, then the quiet moves by
+        history score and last the losing captures by how much they lose
+        :param gs:
+        :param moves:
+        :param hashMove:
+        :param ply:
+        :return:
+        """
+        board = gs.board
+        killers = self.killerMoves[ply]
+        historyTable = self.historyTable
+
+        def moveScore(move):
+            if move == hashMove:
+                return HASH_MOVE_SCORE
+            if capturedPiece(board, move) != '--' or move >> 12 & 3 == ChessEngine.PROMOTION_MOVE:
+                if isLosingCapture(gs, move):  # below the quiet moves, whose history scores are never negative
+                    return Evaluation.staticExchange(gs, move)
+                return CAPTURE_SCORE + mvvLva(board, move)
+            if move == killers[0]:
+                return KILLER_SCORES[0]
+            if move == killers[1]:
+                return KILLER_SCORES[1]
+            startSq = move & 63
+            return historyTable[board[startSq // 8][startSq % 8]][move >> 6 & 63]
+
+        moves.sort(key=moveScore, reverse=True)
+
+    def pickMoves(self, gs, hashMove, ply):
+        """
+        Staged legal move picker for the interior of the search. Yields the hash move, then the captures that do not
+        lose material by MVV-LVA, then the killer moves of this ply, then the remaining quiet moves by history score,
+        then the losing captures. Each stage is only generated when the search asks for a move past the previous one,
+        so after an early beta cutoff the rest is never generated
+        :param gs:
+        :param hashMove:
+        :param ply:
+        :return:
+        """
+        board = gs.board
+        historyTable = self.historyTable
+        gs.prepareMoveGeneration()
+        # the searches below the yielded moves overwrite these, and the later stages need them back
+        generation = (gs.inCheck, gs.pins, gs.checks, gs.checkMask)
+        if hashMove is not None and gs.isLegalMoveCode(hashMove):
+            yield hashMove
+            gs.inCheck, gs.pins, gs.checks, gs.checkMask = generation
+        captures = gs.getMoveCodes(ChessEngine.CAPTURE_MOVES)
+        captures.sort(key=lambda move: mvvLva(board, move), reverse=True)
+        losingCaptures = []
+        for move in captures:
+            if move != hashMove:
+                if isLosingCapture(gs, move):
+                    losingCaptures.append(move)
+                    continue
+                yield move
+                gs.inCheck, gs.pins, gs.checks, gs.checkMask = generation
+        killers = [move for move in self.killerMoves[ply] if move is not None and move != hashMove and
+                   capturedPiece(board, move) == '--' and move >> 12 & 3 != ChessEngine.PROMOTION_MOVE and
+                   gs.isLegalMoveCode(move)]
+        for move in killers:
+            yield move
+            gs.inCheck, gs.pins, gs.checks, gs.checkMask = generation
+        quiets = gs.getMoveCodes(ChessEngine.QUIET_MOVES)
+        quiets.sort(key=lambda move: historyTable[board[(move & 63) // 8][(move & 63) % 8]][move >> 6 & 63],
+                    reverse=True)
+        for move in quiets:
+            if move != hashMove and move not in killers:
+                yield move
+        for move in losingCaptures:
+            yield move
+
+    def recordCutoff(self, gs, move, depth, ply):
+        """
+        A quiet move caused a beta cutoff: remember it as a killer for this ply and credit its history score
+        :param gs:
+        :param move:
+        :param depth:
+        :param ply:
+        :return:
+        """
+        if capturedPiece(gs.board, move) != '--' or move >> 12 & 3 == ChessEngine.PROMOTION_MOVE:
+            return
+        killers = self.killerMoves[ply]
+        if move != killers[0]:
+            killers[1] = killers[0]
+            killers[0] = move
+        startSq = move & 63
+        self.historyTable[gs.board[startSq // 8][startSq % 8]][move >> 6 & 63] += depth * depth
+
+    def findMoveNegaMaxAlphaBeta(self, gs, validMoves, depth, alpha, beta, turnMultiplier, ply=0,
+                                 nullMoveAllowed=True):
+        """
+        Negamax with alpha-beta pruning over packed move codes, searching the first move with the full window and the
+        rest with a null window (principal variation search), with null-move pruning and late move reductions
+        :param gs:
+        :param validMoves: move codes at the root, None below it where pickMoves generates them lazily
+        :param depth:
+        :param alpha:
+        :param beta:
+        :param turnMultiplier:
+        :param ply: distance from the root in half moves, null moves included. Not depth, which reductions make
+        shrink faster than the tree grows
+        :param nullMoveAllowed: False right after a null move, so two passes never follow each other
+        :return:
+        """
+        if depth <= 0:
+            return self.quiescenceSearch(gs, alpha, beta, turnMultiplier, ply)
+        stats = self.stats
+        self.nodeCount += 1
+        stats.nodes += 1
+        if self.nodeCount >= self.nextBudgetCheck:
+            self.checkBudget()
+        isRoot = validMoves is not None
+        if not isRoot and gs.occupied.bit_count() <= self.tablebases.maxPieces:
+            value = self.tablebases.probe(gs)
+            if value is not None:
+                stats.tbHits += 1
+                return tablebaseScore(value, ply)
+
+        key = gs.zobristKey
+        entry = self.transpositionTable.probe(key)
+        stats.ttProbes += 1
+        if entry is not None:
+            stats.ttHits += 1
+        if entry is not None and entry[1] >= depth and not isRoot:  # the root must still pick nextMove
+            flag = entry[2]
+            score = scoreFromTable(entry[3], ply)
+            if flag == EXACT:
+                return score
+            elif flag == LOWERBOUND:
+                alpha = max(alpha, score)
+            elif flag == UPPERBOUND:
+                beta = min(beta, score)
+            if alpha >= beta:
+                return score
+
+        inCheck = gs.isKingAttacked()
+        # null move pruning: if passing the turn still fails high, a real move would too. Not in check, where passing
+        # is illegal, and not with only king and pawns left, where zugzwang makes passing better than any move
+        if nullMoveAllowed and not isRoot and not inCheck and depth >= NULL_MOVE_MIN_DEPTH and \
+                beta < WIN_BOUND and hasPieces(gs) and turnMultiplier * scoreBoard(gs, self.pawnTable) >= beta:
+            gs.makeNullMove()
+            try:
+                score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth - 1 - NULL_MOVE_REDUCTION, -beta, -beta + 1,
+                                                       -turnMultiplier, ply + 1, False)
+            finally:
+                gs.undoNullMove()
+            if score >= beta:
+                return beta
+
+        alphaOriginal = alpha
+        maxScore = -CHECKMATE
+        bestMove = None
+        hashMove = None if entry is None else entry[4]
+        if isRoot:
+            self.orderMoves(gs, validMoves, hashMove, ply)
+            moves = validMoves
+        else:
+            moves = self.pickMoves(gs, hashMove, ply)
+        movesSearched = 0
+        for move in moves:
+            isQuiet = capturedPiece(gs.board, move) == '--' and move >> 12 & 3 != ChessEngine.PROMOTION_MOVE
+            gs.makeMoveCode(move)
+            try:  # the move is taken back even when SearchTimeout unwinds the search
+                if movesSearched == 0:
+                    score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth - 1, -beta, -alpha, -turnMultiplier,
+                                                           ply + 1)
+                else:
+                    # late quiet moves rarely turn out best, so look at them one ply shallower first
+                    reduction = 0
+                    if isQuiet and not inCheck and depth >= LMR_MIN_DEPTH and movesSearched >= LMR_FULL_DEPTH_MOVES \
+                            and move not in self.killerMoves[ply] and not gs.isKingAttacked():
+                        reduction = 1
+                    score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth - 1 - reduction, -alpha - 1, -alpha,
+                                                           -turnMultiplier, ply + 1)
+                    if score > alpha and reduction:
+                        score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth - 1, -alpha - 1, -alpha,
+                                                               -turnMultiplier, ply + 1)
+                    if alpha < score < beta:  # the null window failed high, get the exact score
+                        score = -self.findMoveNegaMaxAlphaBeta(gs, None, depth - 1, -beta, -alpha, -turnMultiplier,
+                                                               ply + 1)
+            finally:
+                gs.undoMove()
+            movesSearched += 1
+            if score > maxScore:
+                maxScore = score
+                bestMove = move
+                if isRoot:
+                    self.nextMove = move
+                    self.nextScore = score
+            if maxScore > alpha:
+                alpha = maxScore
+            if alpha >= beta:
+                self.recordCutoff(gs, move, depth, ply)
+                stats.cutoffs += 1
+                if movesSearched == 1:
+                    stats.firstMoveCutoffs += 1
+                break
+        if movesSearched == 0:  # no legal move
+            maxScore = ply - CHECKMATE if inCheck else STALEMATE
+            if len(gs.moveRecords) - self.rootPly > stats.seldepth:
+                stats.seldepth = len(gs.moveRecords) - self.rootPly
+
+        if maxScore <= alphaOriginal:
+            flag = UPPERBOUND
+        elif maxScore >= beta:
+            flag = LOWERBOUND
+        else:
+            flag = EXACT
+        self.transpositionTable.store(key, depth, flag, scoreToTable(maxScore, ply), bestMove)
+        return maxScore
+
+    def quiescenceSearch(self, gs, alpha, beta, turnMultiplier, ply):
+        """
+        Extend a leaf with captures and promotions until the position is quiet, so the score is not taken in the
+        middle of an exchange. The side to move may stand pat on the static score unless it is in check
+        :param gs:
+        :param alpha:
+        :param beta:
+        :param turnMultiplier:
+        :param ply: distance from the root in half moves
+        :return:
+        """
+        stats = self.stats
+        self.nodeCount += 1
+        stats.qnodes += 1
+        if self.nodeCount >= self.nextBudgetCheck:
+            self.checkBudget()
+        if len(gs.moveRecords) - self.rootPly > stats.seldepth:
+            stats.seldepth = len(gs.moveRecords) - self.rootPly
+        if gs.occupied.bit_count() <= self.tablebases.maxPieces:
+            value = self.tablebases.probe(gs)
+            if value is not None:
+                stats.tbHits += 1
+                return tablebaseScore(value, ply)
+        moves = gs.getCaptureMoveCodes()
+        inCheck = gs.inCheck
+        if inCheck:
+            if len(moves) == 0:
+                return ply - CHECKMATE
+            standPat = maxScore = ply - CHECKMATE
+        else:
+            standPat = maxScore = turnMultiplier * scoreBoard(gs, self.pawnTable)
+            if standPat >= beta:
+                return standPat
+            if standPat > alpha:
+                alpha = standPat
+        board = gs.board
+        moves.sort(key=lambda move: mvvLva(board, move), reverse=True)
+        for move in moves:
+            if not inCheck and move >> 12 & 3 != ChessEngine.PROMOTION_MOVE:
+                if standPat + Evaluation.PIECE_VALUE[capturedPiece(board, move)[1]] + DELTA_MARGIN < alpha:
+                    continue  # delta pruning: even winning the piece for free cannot raise alpha
+                if isLosingCapture(gs, move):
+                    continue  # the recaptures would leave the side to move worse off than standing pat
+            gs.makeMoveCode(move)
+            try:
+                score = -self.quiescenceSearch(gs, -beta, -alpha, -turnMultiplier, ply + 1)
+            finally:
+                gs.undoMove()
+            if score > maxScore:
+                maxScore = score
+            if maxScore > alpha:
+                alpha = maxScore
+            if alpha >= beta:
+                break
+        return maxScore
+
+
+class BackgroundSearch:
+    """
+    Handle of a search running on a worker thread, so a GUI can keep drawing and poll for the move. The game state is
+    copied before the thread starts, so the caller may change its own while the search runs
+    """
+
+    def __init__(self, engine, gs, limits=None, validMoves=None, progress=None, onDone=None):
+        """
+        :param engine:
+        :param gs:
+        :param limits:
+        :param validMoves:
+        :param progress: called on the worker thread with the SearchStats after every finished depth
+        :param onDone: called on the worker thread with the handle once the search is over
+        """
+        self.engine = engine
+        self.limits = limits if limits is not None else SearchLimits()
+        self.limits.stopEvent = threading.Event()
+        self.progress = progress
+        self.onDone = onDone
+        self.move = None
+        self.stats = None
+        self.lock = threading.Lock()
+        self.searching = False  # whether the first depth is done, before that the engine still sets up its budget
+        self.pendingPonderhit = None  # (timeLimit, time of the hit) of a ponderhit that came before the first depth
+        self.thread = threading.Thread(target=self.run, args=(copy.deepcopy(gs), validMoves and list(validMoves)),
+                                       daemon=True)
+        self.thread.start()
+
+    def run(self, gs, validMoves):
+        self.move, self.stats = self.engine.search(gs, self.limits, validMoves, self.depthDone)
+        if self.onDone is not None:
+            self.onDone(self)
+
+    def depthDone(self, stats):
+        with self.lock:
+            if not self.searching:
+                self.searching = True
+                if self.pendingPonderhit is not None:
+                    self.engine.ponderhit(*self.pendingPonderhit)
+        if self.progress is not None:
+            self.progress(stats)
+
+    def done(self):
+        return not self.thread.is_alive()
+
+    def ponderhit(self, timeLimit):
+        """
+        Give a search started without a time limit, while pondering, timeLimit seconds from now
+        :param timeLimit:
+        :return:
+        """
+        with self.lock:
+            if self.searching:
+                self.engine.ponderhit(timeLimit)
+            else:
+                self.pendingPonderhit = (timeLimit, time.perf_counter())
+
+    def stop(self):
+        """
+        Ask the search to end without waiting for it
+        :return:
+        """
+        self.limits.stopEvent.set()
+
+    def cancel(self):
+        """
+        Stop the search and wait for the thread to end, which takes at most one budget check once a root move has a
+        score. Searches split across worker processes also wait for the workers to finish their depth
+        :return:
+        """
+        self.stop()
+        self.thread.join()
+
+
+defaultEngine = SearchEngine()  # behind the module level find... functions
+workerEngine = None  # the engine of a parallel search worker process, created on its first task
+
+
 def findBestMoveMinMax(gs, validMoves):
     """
-    Helper method to make first recursive call
+    Search validMoves to the fixed DEPTH
     :param gs:
     :param validMoves:
     :return:
     """
-    global nextMove
-    nextMove = None
-    random.shuffle(validMoves)
     # findMoveMinMax(gs, validMoves, DEPTH, gs.whiteToMove)
     # findMoveNegaMax(gs, validMoves, DEPTH, 1 if gs.whiteToMove else -1)
-    findMoveNegaMaxAlphaBeta(gs, validMoves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1)
-    return nextMove
+    return defaultEngine.search(gs, SearchLimits(maxDepth=DEPTH), validMoves)[0]
+
+
+def findBestMoveIterative(gs, validMoves, timeLimit=None, nodeLimit=None, maxDepth=None, workers=1):
+    """
+    Iterative deepening: search depth 1, 2, 3... until the time (seconds) or node budget runs out and return the best
+    move of the last depth that finished. Depth 1 always finishes, so a move is returned whenever one exists.
+    Without any budget the search stops at DEPTH unless maxDepth says otherwise. With workers > 1 the root moves are
+    split across that many processes
+    :param gs:
+    :param validMoves:
+    :param timeLimit:
+    :param nodeLimit:
+    :param maxDepth:
+    :param workers:
+    :return:
+    """
+    return findBestMoveWithStats(gs, validMoves, timeLimit, nodeLimit, maxDepth, workers)[0]
+
+
+def findBestMoveWithStats(gs, validMoves, timeLimit=None, nodeLimit=None, maxDepth=None, workers=1, progress=None):
+    """
+    findBestMoveIterative that also returns the SearchStats of the search
+    :param gs:
+    :param validMoves:
+    :param timeLimit:
+    :param nodeLimit:
+    :param maxDepth:
+    :param workers:
+    :param progress: called with the SearchStats after every finished depth
+    :return: (best move, stats)
+    """
+    return defaultEngine.search(gs, SearchLimits(timeLimit, nodeLimit, maxDepth, workers), validMoves, progress)
 
 
 def moveFinder(gs, validMoves):
-    global nextMove
-    nextMove = None
-    findMoveNegaMaxAlphaBeta(gs, validMoves, 3, -CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1)
-    return nextMove
+    return defaultEngine.search(gs, SearchLimits(maxDepth=3), validMoves)[0]
+
+
+def searchRootMoves(gs, rootMoves, depth, alpha, ply, searchId, timeLimit, nodeLimit):
+    """
+    Worker process entry point for SearchEngine.searchSplitDepth
+    :param gs:
+    :param rootMoves: move codes, plain ints so they cross the process boundary cheaply
+    :param depth:
+    :param alpha:
+    :param ply:
+    :param searchId:
+    :param timeLimit:
+    :param nodeLimit:
+    :return: SearchEngine.searchMoves's (score, move code, expected line) followed by the worker's SearchStats
+    """
+    global workerEngine
+    if workerEngine is None:
+        workerEngine = SearchEngine()
+    score, move, pv = workerEngine.searchMoves(gs, rootMoves, depth, alpha, ply, searchId, timeLimit,
+                                                  nodeLimit)
+    return score, move, pv, workerEngine.stats
+
+
+def getProcessPool(workers):
+    """
+    Process pool of this many workers shared by the parallel searches of every engine. There is one pool per worker
+    count and none is ever shut down, so a search asking for another count cannot pull a pool from under a search
+    still submitting to it
+    :param workers:
+    :return:
+    """
+    with processPoolLock:
+        pool = processPools.get(workers)
+        if pool is None:
+            pool = processPools[workers] = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        return pool
 
 
 def findMoveMinMax(gs, validMoves, depth, whiteToMove):
@@ -128,33 +1051,139 @@ def findMoveNegaMax(gs, validMoves, depth, turnMultiplier):
     return maxScore
 
 
-def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier):
-    global nextMove
-    if depth == 0:
-        return turnMultiplier * scoreBoard(gs)
+def capturedPiece(board, move):
+    """
+    The piece a move code takes on board, '--' for a quiet move
+    :param board:
+    :param move:
+    :return:
+    """
+    endSq = move >> 6 & 63
+    if move >> 12 & 3 == ChessEngine.ENPASSANT_MOVE:  # white captures en passant on row 2, black on row 5
+        return 'bp' if endSq < 32 else 'wp'
+    return board[endSq // 8][endSq % 8]
 
-    maxScore = -CHECKMATE
-    for move in validMoves:
-        gs.makeMove(move)
-        nextMoves = gs.getValidMoves()
-        score = -findMoveNegaMaxAlphaBeta(gs, nextMoves, depth - 1, -beta, -alpha, -turnMultiplier)
-        if score > maxScore:
-            maxScore = score
-            if depth == DEPTH:
-                nextMove = move
-        gs.undoMove()
-        if maxScore > alpha:
-            alpha = maxScore
-        if alpha >= beta:
-            break
-    return maxScore
+
+def mvvLva(board, move):
+    """
+    Most valuable victim / least valuable attacker score of a capture or promotion
+    :param board:
+    :param move:
+    :return:
+    """
+    startSq = move & 63
+    score = -orderingValue[board[startSq // 8][startSq % 8][1]]
+    pieceCaptured = capturedPiece(board, move)
+    if pieceCaptured != '--':
+        score += 10 * orderingValue[pieceCaptured[1]]
+    if move >> 12 & 3 == ChessEngine.PROMOTION_MOVE:
+        score += 10 * orderingValue[ChessEngine.PROMOTION_PIECES[move >> 14]]
+    return score
 
 
-def scoreBoard(gs):
+def isLosingCapture(gs, move):
     """
-    A positive score is good for white
+    Whether a capture or promotion loses material by static exchange evaluation. Taking a piece worth at least the
+    capturing one never does, so the exchange is only played out for the others
+    :param gs:
+    :param move:
     :return:
     """
+    board = gs.board
+    pieceCaptured = capturedPiece(board, move)
+    if pieceCaptured != '--' and move >> 12 & 3 != ChessEngine.PROMOTION_MOVE:
+        startSq = move & 63
+        if Evaluation.EXCHANGE_VALUE[pieceCaptured[1]] >= \
+                Evaluation.EXCHANGE_VALUE[board[startSq // 8][startSq % 8][1]]:
+            return False
+    return Evaluation.staticExchange(gs, move) < 0
+
+
+def hasPieces(gs):
+    """
+    Whether the side to move has a piece other than pawns and the king
+    :param gs:
+    :return:
+    """
+    color = 'w' if gs.whiteToMove else 'b'
+    return bool(gs.bitboards[color + 'N'] | gs.bitboards[color + 'B'] | gs.bitboards[color + 'R'] |
+                gs.bitboards[color + 'Q'])
+
+
+def tablebaseScore(value, ply):
+    """
+    Search score of an endgame table result, sooner mates scoring higher
+    :param value: table byte from the side to move's point of view
+    :param ply: distance of the position from the root in half moves
+    :return:
+    """
+    if value == Tablebase.DRAW:
+        return STALEMATE
+    plies = ply + Tablebase.pliesToMate(value)
+    return TABLEBASE_WIN - plies if Tablebase.isWin(value) else plies - TABLEBASE_WIN
+
+
+def scoreToTable(score, ply):
+    """
+    A search score as the transposition table keeps it: mate and table win scores count plies from the node instead
+    of from the root, so the entry holds wherever the position comes up again
+    :param score:
+    :param ply: distance of the node from the root in half moves
+    :return:
+    """
+    if score >= WIN_BOUND:
+        return score + ply
+    if score <= -WIN_BOUND:
+        return score - ply
+    return score
+
+
+def scoreFromTable(score, ply):
+    """
+    Undo scoreToTable for a node ply half moves below the root
+    :param score:
+    :param ply:
+    :return:
+    """
+    if score >= WIN_BOUND:
+        return score - ply
+    if score <= -WIN_BOUND:
+        return score + ply
+    return score
+
+
+def matePlies(score):
+    """
+    Half moves to the mate a score announces, whether the search found it or the endgame tables know it
+    :param score: from the side to move's point of view
+    :return: positive when the side to move mates, negative when it is mated, None when the score is no mate
+    """
+    if abs(score) < WIN_BOUND:
+        return None
+    plies = CHECKMATE - abs(score) if abs(score) > TABLEBASE_WIN else TABLEBASE_WIN - abs(score)
+    return plies if score > 0 else -plies
+
+
+def mateMoves(score):
+    """
+    Moves to the mate a score announces, counted the way UCI does: the mating side's moves
+    :param score: from the side to move's point of view
+    :return: positive when the side to move mates, negative when it is mated, 0 when it is checkmated already, None
+    when the score is no mate
+    """
+    plies = matePlies(score)
+    if plies is None:
+        return None
+    return (plies + 1) // 2 if plies > 0 else plies // 2
+
+
+def scoreBoard(gs, pawnTable=None):
+    """
+    A positive score is good for white
+    :param gs:
+    :param pawnTable: Evaluation.PawnHashTable to cache the pawn structure terms in
+    :return: centipawns
+    """
     if gs.checkMate:
         if gs.whiteToMove:
             return -CHECKMATE
@@ -162,14 +1191,7 @@ def scoreBoard(gs):
             return CHECKMATE
     elif gs.staleMate:
         return STALEMATE
-    score = 0
-    for row in gs.board:
-        for square in row:
-            if square[0] == "w":
-                score += pieceScore[square[1]]
-            elif square[0] == "b":
-                score -= pieceScore[square[1]]
-    return score
+    return Evaluation.evaluate(gs, pawnTable)
 
 
 def scoreMaterial(board):
@@ -0,0 +1,474 @@
+import argparse
+import mmap
+import os
+import sys
+import time
+from Chess import ChessEngine
+
+# Endgame tables: one file per material, e.g. KQKR.tb for king and queen against king and rook, holding one byte per
+# position at index sideToMove * 64^n + the squares of the pieces in the order of the name, white before black.
+# A byte of 0 is a draw (or a position that cannot occur), anything else is plies to mate + 1 from the side to
+# move's point of view: an odd number of plies is a win, an even number a loss, 1 meaning checkmated
+TABLEBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Tablebases")
+FILE_EXTENSION = ".tb"
+MAX_PIECES = 4
+DRAW = 0
+MAX_PLIES = 254  # the longest distance to mate a byte can hold
+PIECE_ORDER = "KQRBNP"  # order of the pieces within a side in table names and indices
+MATERIAL_VALUE = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "P": 1}
+DEFAULT_TABLES = ("KQK", "KRK", "KPK")
+ORTHOGONAL_LINE = 1
+DIAGONAL_LINE = 2
+# flags of positions during generation
+VALID = 1
+DRAW_EXIT = 2  # a capture or promotion reaches a drawn position, so the side to move cannot lose
+WIN_EXIT = 4  # a capture or promotion wins
+
+
+def buildLines():
+    """
+    For every pair of squares on a common line, the kind of line and the bitboard of the squares strictly between
+    :return: (list of line kinds, list of bitboards), both indexed by from * 64 + to
+    """
+    lines = [0] * 4096
+    between = [0] * 4096
+    for d in ChessEngine.KING_STEPS:
+        kind = ORTHOGONAL_LINE if d in ChessEngine.ORTHOGONAL else DIAGONAL_LINE
+        for sq in range(64):
+            passed = 0
+            row, col = sq // 8 + d[0], sq % 8 + d[1]
+            while 0 <= row < 8 and 0 <= col < 8:
+                lines[sq * 64 + row * 8 + col] = kind
+                between[sq * 64 + row * 8 + col] = passed
+                passed |= 1 << (row * 8 + col)
+                row += d[0]
+                col += d[1]
+    return lines, between
+
+
+def buildSlides():
+    """
+    For every slider and square, the squares along each direction it moves in, nearest first
+    :return: dict piece letter -> list of 64 lists of square lists
+    """
+    directions = {"R": ChessEngine.ORTHOGONAL, "B": ChessEngine.DIAGONAL, "Q": ChessEngine.KING_STEPS}
+    slides = {}
+    for kind, steps in directions.items():
+        table = []
+        for sq in range(64):
+            rays = []
+            for d in steps:
+                ray = []
+                row, col = sq // 8 + d[0], sq % 8 + d[1]
+                while 0 <= row < 8 and 0 <= col < 8:
+                    ray.append(row * 8 + col)
+                    row += d[0]
+                    col += d[1]
+                rays.append(ray)
+            table.append(rays)
+        slides[kind] = table
+    return slides
+
+
+LINES, BETWEEN = buildLines()
+SLIDES = buildSlides()
+LEAPS = {"K": [[sq for sq in range(64) if bb >> sq & 1] for bb in ChessEngine.KING_TABLE],
+         "N": [[sq for sq in range(64) if bb >> sq & 1] for bb in ChessEngine.KNIGHT_TABLE]}
+
+
+def parseMaterial(name):
+    """
+    The pieces of a table name such as KQKR
+    :param name:
+    :return: tuple of (color, piece letter) in index order
+    """
+    second = name.find("K", 1)
+    if not name.startswith("K") or second < 0 or any(char not in PIECE_ORDER for char in name) or \
+            name.count("K") != 2:
+        raise ValueError("Not a table name, it needs a K for each side followed by their pieces: " + name)
+    if len(name) > MAX_PIECES:
+        raise ValueError("Tables are limited to %d pieces: %s" % (MAX_PIECES, name))
+    return tuple(("w", kind) for kind in name[:second]) + tuple(("b", kind) for kind in name[second:])
+
+
+def sideName(kinds):
+    return "".join(sorted(kinds, key=PIECE_ORDER.index))
+
+
+def canonicalName(whiteKinds, blackKinds):
+    """
+    Name of the table holding a material balance. Tables are only built with the stronger side as white, positions
+    with the colors the other way round are looked up with the board mirrored
+    :param whiteKinds: piece letters of white, king included
+    :param blackKinds:
+    :return: (name, whether the colors must be swapped)
+    """
+    white = sideName(whiteKinds)
+    black = sideName(blackKinds)
+    if (sum(MATERIAL_VALUE[kind] for kind in white), white) >= (sum(MATERIAL_VALUE[kind] for kind in black), black):
+        return white + black, False
+    return black + white, True
+
+
+def isDrawnMaterial(name):
+    """
+    Whether no position of the material can ever be mate: bare kings, or a single knight or bishop against a bare king
+    :param name:
+    :return:
+    """
+    return name in ("KK", "KBK", "KNK")
+
+
+def tableIndex(pieces, blackToMove):
+    """
+    Table and index of a position
+    :param pieces: list of (color, piece letter, square)
+    :param blackToMove:
+    :return: (table name, index)
+    """
+    name, swapped = canonicalName([kind for color, kind, sq in pieces if color == "w"],
+                                  [kind for color, kind, sq in pieces if color == "b"])
+    if swapped:  # mirror the ranks so the pawns of the new white side still move up the board
+        pieces = [("b" if color == "w" else "w", kind, sq ^ 56) for color, kind, sq in pieces]
+        blackToMove = not blackToMove
+    index = 1 if blackToMove else 0
+    for color, kind, sq in sorted(pieces, key=lambda piece: (piece[0] != "w", PIECE_ORDER.index(piece[1]), piece[2])):
+        index = index << 6 | sq
+    return name, index
+
+
+def isWin(value):
+    return value != DRAW and value % 2 == 0
+
+
+def pliesToMate(value):
+    return value - 1
+
+
+def attacks(kind, color, fromSq, toSq, occupied):
+    """
+    Whether a piece on fromSq attacks toSq
+    :param kind: piece letter
+    :param color:
+    :param fromSq:
+    :param toSq:
+    :param occupied: bitboard of all pieces
+    :return:
+    """
+    if kind == "K":
+        return ChessEngine.KING_TABLE[fromSq] >> toSq & 1
+    if kind == "N":
+        return ChessEngine.KNIGHT_TABLE[fromSq] >> toSq & 1
+    if kind == "P":
+        return ChessEngine.PAWN_ATTACKS[color][fromSq] >> toSq & 1
+    line = LINES[fromSq * 64 + toSq]
+    if line == 0 or (kind == "R" and line == DIAGONAL_LINE) or (kind == "B" and line == ORTHOGONAL_LINE):
+        return False
+    return not BETWEEN[fromSq * 64 + toSq] & occupied
+
+
+class Tablebases:
+    """
+    The tables found in a directory, each memory-mapped the first time a position of its material is probed
+    """
+
+    def __init__(self, directory=TABLEBASE_DIR):
+        self.directory = directory
+        self.tables = {}  # name -> mmap
+        self.names = set()
+        if os.path.isdir(directory):
+            self.names = {f[:-len(FILE_EXTENSION)] for f in os.listdir(directory) if f.endswith(FILE_EXTENSION)}
+        # most pieces a probe can answer for, 0 when there are no tables
+        self.maxPieces = max((len(name) for name in self.names), default=0)
+
+    def close(self):
+        for data in self.tables.values():
+            data.close()
+        self.tables = {}
+
+    def table(self, name):
+        data = self.tables.get(name)
+        if data is None:
+            with open(os.path.join(self.directory, name + FILE_EXTENSION), "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.tables[name] = data
+        return data
+
+    def probePieces(self, pieces, blackToMove):
+        """
+        :param pieces: list of (color, piece letter, square)
+        :param blackToMove:
+        :return: the table byte of the position, None when there is no table for its material
+        """
+        name, index = tableIndex(pieces, blackToMove)
+        if isDrawnMaterial(name):
+            return DRAW
+        if name not in self.names:
+            return None
+        return self.table(name)[index]
+
+    def probe(self, gs):
+        """
+        Look a game position up. Castling rights and en passant captures are not part of the tables, so positions
+        where either is possible are not answered
+        :param gs:
+        :return: the table byte of the position from the side to move's point of view, None when it is not covered
+        """
+        if gs.occupied.bit_count() > self.maxPieces or gs.currentCastlingRight.toIndex() != 0:
+            return None
+        if gs.enpassantPossible != () and gs.bitboards["wp" if gs.whiteToMove else "bp"]:
+            return None
+        pieces = []
+        for piece in ChessEngine.PIECES:
+            bitboard = gs.bitboards[piece]
+            while bitboard:
+                sq = (bitboard & -bitboard).bit_length() - 1
+                pieces.append((piece[0], piece[1].upper(), sq))
+                bitboard &= bitboard - 1
+        return self.probePieces(pieces, not gs.whiteToMove)
+
+
+def dependencies(name):
+    """
+    Tables a table's captures and promotions lead into
+    :param name:
+    :return: set of canonical names, without the trivially drawn ones
+    """
+    material = parseMaterial(name)
+    result = set()
+    for i, (color, kind) in enumerate(material):
+        if kind == "K":
+            continue
+        rest = material[:i] + material[i + 1:]
+        changes = [rest]  # the piece is captured
+        if kind == "P":
+            changes += [rest + ((color, promoted),) for promoted in "QRBN"]
+        for pieces in changes:
+            child = canonicalName([k for c, k in pieces if c == "w"], [k for c, k in pieces if c == "b"])[0]
+            if not isDrawnMaterial(child):
+                result.add(child)
+    return result
+
+
+def generate(name, directory=TABLEBASE_DIR, progress=None):
+    """
+    Build a table by retrograde analysis. Every legal position is scored by its moves once: checkmates, stalemates
+    and captures or promotions into smaller tables seed the results, which then spread backwards by un-making moves
+    one ply at a time, so every position gets its exact distance to mate. The tables of the captures and promotions
+    must exist already. En passant is left out, as for probing
+    :param name: canonical table name
+    :param directory:
+    :param progress: called with a line of text after each step
+    :return: path of the written file
+    """
+    material = parseMaterial(name)
+    if canonicalName([k for c, k in material if c == "w"], [k for c, k in material if c == "b"])[0] != name:
+        raise ValueError("Tables are built with the stronger side as white, %s is not such a name" % name)
+    subtables = Tablebases(directory)
+    for child in dependencies(name):
+        if child not in subtables.names:
+            raise ValueError("%s needs the %s table to be generated first" % (name, child))
+    n = len(material)
+    colors = [color for color, kind in material]
+    kinds = [kind for color, kind in material]
+    kings = {color: kinds.index("K") if color == "w" else kinds.index("K", 1) for color in "wb"}
+    size = 2 << 6 * n
+    values = bytearray(size)
+    counts = bytearray(size)  # moves staying in the table not yet known to lose
+    flags = bytearray(size)
+    exitLosses = bytearray(size)  # plies to the slowest loss through a capture or promotion
+    buckets = [[] for plies in range(MAX_PLIES + 2)]
+    startTime = time.perf_counter()
+
+    # score every position by its own moves
+    for index in range(size):
+        side = index >> 6 * n
+        squares = [index >> 6 * (n - 1 - i) & 63 for i in range(n)]
+        occupied = 0
+        for sq in squares:
+            occupied |= 1 << sq
+        if occupied.bit_count() != n:
+            continue
+        if any(kind == "P" and (sq < 8 or sq >= 56) for kind, sq in zip(kinds, squares)):
+            continue
+        us = "w" if side == 0 else "b"
+        them = "b" if side == 0 else "w"
+        if any(colors[i] == us and attacks(kinds[i], us, squares[i], squares[kings[them]], occupied)
+               for i in range(n)):
+            continue  # the side that just moved left its king in check
+        flags[index] = VALID
+        ourKing = kings[us]
+        inTable = 0
+        exits = []
+        for i in range(n):
+            if colors[i] != us:
+                continue
+            kind = kinds[i]
+            fromSq = squares[i]
+            targets = []  # (square, promotion piece or None)
+            if kind == "K" or kind == "N":
+                targets = [(sq, None) for sq in LEAPS[kind][fromSq]]
+            elif kind == "P":
+                step = -8 if us == "w" else 8
+                lastRow = 0 if us == "w" else 7
+                pushes = []
+                if not occupied >> (fromSq + step) & 1:
+                    pushes.append(fromSq + step)
+                    if fromSq // 8 == (6 if us == "w" else 1) and not occupied >> (fromSq + 2 * step) & 1:
+                        pushes.append(fromSq + 2 * step)
+                bitboard = ChessEngine.PAWN_ATTACKS[us][fromSq]
+                captures = [sq for sq in squares if bitboard >> sq & 1]
+                for sq in pushes + captures:
+                    if sq // 8 == lastRow:
+                        targets += [(sq, promoted) for promoted in "QRBN"]
+                    else:
+                        targets.append((sq, None))
+            else:
+                for ray in SLIDES[kind][fromSq]:
+                    for sq in ray:
+                        targets.append((sq, None))
+                        if occupied >> sq & 1:
+                            break
+            for toSq, promoted in targets:
+                captured = squares.index(toSq) if occupied >> toSq & 1 else -1
+                if captured >= 0 and colors[captured] == us:
+                    continue
+                newOccupied = occupied & ~(1 << fromSq) | 1 << toSq
+                kingSq = toSq if i == ourKing else squares[ourKing]
+                if any(colors[j] == them and j != captured and attacks(kinds[j], them, squares[j], kingSq, newOccupied)
+                       for j in range(n)):
+                    continue
+                if captured < 0 and promoted is None:
+                    inTable += 1
+                    continue
+                pieces = [(colors[j], promoted if j == i and promoted else kinds[j], toSq if j == i else squares[j])
+                          for j in range(n) if j != captured]
+                value = subtables.probePieces(pieces, side == 0)
+                exits.append(value)
+        if inTable == 0 and len(exits) == 0:
+            if any(colors[j] == them and attacks(kinds[j], them, squares[j], squares[ourKing], occupied)
+                   for j in range(n)):
+                buckets[0].append(index)  # checkmated
+            continue  # stalemate stays a draw
+        counts[index] = inTable
+        for value in exits:  # the exit value is from the opponent's point of view
+            if value == DRAW:
+                flags[index] |= DRAW_EXIT
+            elif isWin(value):
+                exitLosses[index] = max(exitLosses[index], pliesToMate(value) + 1)
+            else:
+                flags[index] |= WIN_EXIT
+                buckets[pliesToMate(value) + 1].append(index)
+        if inTable == 0 and not flags[index] & (DRAW_EXIT | WIN_EXIT):
+            buckets[exitLosses[index]].append(index)  # every move is a capture or promotion that loses
+    if progress is not None:
+        progress("%s: scored %d positions in %.1fs" % (name, size, time.perf_counter() - startTime))
+
+    # spread the results backwards, in order of distance to mate
+    for plies in range(MAX_PLIES + 1):
+        bucket = buckets[plies]
+        lost = plies % 2 == 0
+        for index in bucket:
+            if values[index] != DRAW:
+                continue
+            values[index] = plies + 1
+            side = index >> 6 * n
+            mover = "b" if side == 0 else "w"  # the side whose move led here
+            squares = [index >> 6 * (n - 1 - i) & 63 for i in range(n)]
+            occupied = 0
+            for sq in squares:
+                occupied |= 1 << sq
+            for i in range(n):
+                if colors[i] != mover:
+                    continue
+                kind = kinds[i]
+                toSq = squares[i]
+                origins = []
+                if kind == "K" or kind == "N":
+                    origins = [sq for sq in LEAPS[kind][toSq] if not occupied >> sq & 1]
+                elif kind == "P":
+                    step = 8 if mover == "w" else -8  # back down the board for white
+                    fromSq = toSq + step
+                    if 8 <= fromSq < 56 and not occupied >> fromSq & 1:
+                        origins.append(fromSq)
+                        if toSq // 8 == (4 if mover == "w" else 3) and not occupied >> (fromSq + step) & 1:
+                            origins.append(fromSq + step)
+                else:
+                    for ray in SLIDES[kind][toSq]:
+                        for sq in ray:
+                            if occupied >> sq & 1:
+                                break
+                            origins.append(sq)
+                shift = 6 * (n - 1 - i)
+                base = (index & ~(63 << shift)) ^ (1 << 6 * n)  # the other side to move, piece i lifted
+                for fromSq in origins:
+                    parent = base | fromSq << shift
+                    if not flags[parent] & VALID or values[parent] != DRAW:
+                        continue
+                    if lost:
+                        buckets[plies + 1].append(parent)
+                    else:
+                        counts[parent] -= 1
+                        if counts[parent] == 0 and not flags[parent] & (DRAW_EXIT | WIN_EXIT):
+                            buckets[max(plies + 1, exitLosses[parent])].append(parent)
+        buckets[plies] = None
+    if any(buckets[MAX_PLIES + 1]):
+        raise ValueError("%s has mates longer than %d plies" % (name, MAX_PLIES))
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + FILE_EXTENSION)
+    with open(path + ".tmp", "wb") as f:
+        f.write(values)
+    os.replace(path + ".tmp", path)  # a half written table is never picked up
+    subtables.close()
+    if progress is not None:
+        progress("%s: %d wins, %d losses, written in %.1fs" % (
+            name, sum(1 for value in values if isWin(value)), sum(1 for value in values if value and not isWin(value)),
+            time.perf_counter() - startTime))
+    return path
+
+
+def generateWithDependencies(name, directory=TABLEBASE_DIR, progress=None):
+    """
+    Build a table and every table it depends on that is missing
+    :param name:
+    :param directory:
+    :param progress:
+    :return:
+    """
+    existing = Tablebases(directory).names
+    for child in sorted(dependencies(name), key=len):
+        if child not in existing:
+            generateWithDependencies(child, directory, progress)
+    if name not in Tablebases(directory).names:
+        generate(name, directory, progress)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate endgame tables, or probe a position")
+    parser.add_argument("tables", nargs="*", default=list(DEFAULT_TABLES),
+                        help="names such as KQK or KRKN, the stronger side first. Three piece tables take a minute, "
+                             "four piece tables hours. Default: " + " ".join(DEFAULT_TABLES))
+    parser.add_argument("--directory", default=TABLEBASE_DIR)
+    parser.add_argument("--probe", metavar="FEN", help="print the table result of a position instead")
+    args = parser.parse_args(argv)
+    try:
+        if args.probe is not None:
+            value = Tablebases(args.directory).probe(ChessEngine.GameState.fromFEN(args.probe))
+            if value is None:
+                print("not in the tables")
+            elif value == DRAW:
+                print("draw")
+            else:
+                print("%s in %d plies" % ("win" if isWin(value) else "loss", pliesToMate(value)))
+            return 0
+        for name in args.tables:
+            generateWithDependencies(name, args.directory, print)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+import sys
+import threading
+from Chess import ChessEngine, OpeningBook, SmartMoveFinder, Tablebase
+
+ENGINE_NAME = "Chess"
+ENGINE_AUTHOR = "the Chess project contributors"
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+DEFAULT_MOVES_TO_GO = 30  # moves the remaining clock time is spread over when the GUI does not say
+MOVE_OVERHEAD = 0.05  # seconds kept back per move for the GUI and the pipe
+MIN_MOVE_TIME = 0.01  # seconds searched at least while the clock allows it
+
+
+class UciSession:
+    """
+    Universal Chess Interface front end: reads commands line by line and answers on out. The search runs on a worker
+    thread so stop, isready and quit are answered while it thinks
+    """
+
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.outLock = threading.Lock()  # the search thread writes info and bestmove lines too
+        self.engine = SmartMoveFinder.SearchEngine()
+        self.gs = ChessEngine.GameState()
+        self.search = None  # BackgroundSearch of the running go
+        self.release = None  # set once the running go may print its bestmove, see go
+        self.ponderTimeLimit = None  # seconds a go ponder gets once ponderhit arrives
+        self.ownBook = True
+        self.bookFile = OpeningBook.DEFAULT_BOOK
+        self.book = None  # opened on the first go that may use it
+
+    def send(self, line):
+        with self.outLock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    def handle(self, line):
+        """
+        Execute one command
+        :param line:
+        :return: False once the session should end
+        """
+        tokens = line.split()
+        if len(tokens) == 0:
+            return True
+        command = tokens[0]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max 4096" % SmartMoveFinder.TT_SIZE_MB)
+            self.send("option name Ponder type check default false")
+            self.send("option name OwnBook type check default true")
+            self.send("option name BookFile type string default " + OpeningBook.DEFAULT_BOOK)
+            self.send("option name TablebasePath type string default " + Tablebase.TABLEBASE_DIR)
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.setOption(tokens[1:])
+        elif command == "ucinewgame":
+            self.stopSearch()
+            self.engine.transpositionTable.clear()
+        elif command == "position":
+            self.stopSearch()
+            self.setPosition(tokens[1:])
+        elif command == "go":
+            self.stopSearch()
+            self.go(tokens[1:])
+        elif command == "ponderhit":
+            self.ponderhit()
+        elif command == "stop":
+            self.stopSearch()
+        elif command == "quit":
+            self.stopSearch()
+            return False
+        else:
+            self.send("info string unknown command " + command)
+        return True
+
+    def setOption(self, tokens):
+        """
+        setoption name <name> value <value> for Hash (megabytes), OwnBook, BookFile and TablebasePath
+        :param tokens:
+        :return:
+        """
+        if "name" not in tokens or "value" not in tokens:
+            return
+        name = " ".join(tokens[tokens.index("name") + 1:tokens.index("value")])
+        value = " ".join(tokens[tokens.index("value") + 1:])
+        if name.lower() == "hash":
+            self.stopSearch()
+            try:
+                self.engine.transpositionTable.resize(int(value))
+            except ValueError:
+                self.send("info string Hash must be a number of megabytes")
+        elif name.lower() == "ponder":  # the GUI asks before sending go ponder, nothing to set up
+            pass
+        elif name.lower() == "ownbook":
+            self.ownBook = value.lower() == "true"
+        elif name.lower() == "bookfile":
+            self.closeBook()
+            self.bookFile = value
+        elif name.lower() == "tablebasepath":
+            self.stopSearch()
+            self.engine.tablebases.close()
+            self.engine.tablebases = Tablebase.Tablebases(value)
+        else:
+            self.send("info string unknown option " + name)
+
+    def setPosition(self, tokens):
+        """
+        position startpos [moves ...] or position fen <fen> [moves ...]
+        :param tokens:
+        :return:
+        """
+        moves = []
+        if "moves" in tokens:
+            moves = tokens[tokens.index("moves") + 1:]
+            tokens = tokens[:tokens.index("moves")]
+        if len(tokens) == 0:
+            return
+        try:
+            if tokens[0] == "startpos":
+                gs = ChessEngine.GameState.fromFEN(START_FEN)
+            elif tokens[0] == "fen":
+                gs = ChessEngine.GameState.fromFEN(" ".join(tokens[1:]))
+            else:
+                return
+        except ValueError as e:
+            self.send("info string " + str(e))
+            return
+        for notation in moves:
+            move = findMove(gs, notation)
+            if move is None:
+                self.send("info string illegal move " + notation)
+                break
+            gs.makeMove(move)
+        self.gs = gs
+
+    def go(self, tokens):
+        """
+        go [depth n] [nodes n] [movetime ms] [wtime ms btime ms [winc ms] [binc ms] [movestogo n]] [infinite] [ponder]
+        With ponder the position ends with the move the engine expects the opponent to play. It is searched without a
+        time limit until ponderhit says the move was played, from when the time limit applies, or stop says it was not
+        :param tokens:
+        :return:
+        """
+        ponder = "ponder" in tokens
+        if self.ownBook and "infinite" not in tokens and not ponder:
+            move = self.bookMove()
+            if move is not None:
+                self.send("bestmove " + move.getChessNotation())
+                return
+        options = {}
+        for i in range(len(tokens) - 1):
+            if tokens[i] in ("depth", "nodes", "movetime", "wtime", "btime", "winc", "binc", "movestogo"):
+                try:
+                    options[tokens[i]] = int(tokens[i + 1])
+                except ValueError:
+                    pass
+        timeLimit = None
+        if "movetime" in options:
+            timeLimit = options["movetime"] / 1000
+        elif "infinite" not in tokens:
+            clock = options.get("wtime" if self.gs.whiteToMove else "btime")
+            if clock is not None:
+                increment = options.get("winc" if self.gs.whiteToMove else "binc", 0)
+                timeLimit = allocateTime(clock / 1000, increment / 1000, options.get("movestogo"))
+        maxDepth = options.get("depth")
+        if ponder:
+            # without a clock or depth, a hit just returns what pondering found
+            self.ponderTimeLimit = timeLimit if timeLimit is not None or maxDepth is not None else 0
+            timeLimit = None
+        if maxDepth is None and ("infinite" in tokens or ponder):
+            maxDepth = SmartMoveFinder.MAX_DEPTH
+        # bestmove is held back until stop for go infinite, and until ponderhit or stop while pondering
+        self.release = threading.Event()
+        if "infinite" not in tokens and not ponder:
+            self.release.set()
+        limits = SmartMoveFinder.SearchLimits(timeLimit, options.get("nodes"), maxDepth)
+        self.search = SmartMoveFinder.BackgroundSearch(self.engine, self.gs, limits, progress=self.sendInfo,
+                                                       onDone=self.sendBestMove)
+
+    def ponderhit(self):
+        """
+        The opponent played the move being pondered on: the search goes on as a normal one
+        :return:
+        """
+        if self.search is not None:
+            self.search.ponderhit(self.ponderTimeLimit)
+            self.release.set()
+
+    def bookMove(self):
+        """
+        A move for the current position from the opening book
+        :return: the Move, or None when there is no book or the position is not in it
+        """
+        if self.book is None:
+            try:
+                self.book = OpeningBook.openBook(self.bookFile)
+            except (OSError, ValueError) as e:
+                self.send("info string cannot open book: " + str(e))
+                self.ownBook = False
+            if self.book is None:
+                return None
+        return self.book.chooseMove(self.gs)
+
+    def closeBook(self):
+        if self.book is not None:
+            self.book.close()
+            self.book = None
+
+    def sendBestMove(self, search):
+        """
+        Called on the search thread when the search is over. Also names the reply expected next, to ponder on
+        :param search: BackgroundSearch
+        :return:
+        """
+        self.release.wait()
+        if search.move is None:
+            self.send("bestmove 0000")
+            return
+        line = "bestmove " + search.move.getChessNotation()
+        pv = search.stats.depths[-1]["pv"] if search.stats.depths else []
+        if len(pv) > 1 and pv[0] == search.move.getChessNotation():
+            line += " ponder " + pv[1]
+        self.send(line)
+
+    def sendInfo(self, stats):
+        """
+        Progress callback of the search, one info line per finished depth
+        :param stats:
+        :return:
+        """
+        record = stats.depths[-1]
+        self.send("info depth %d seldepth %d score %s nodes %d nps %d time %d pv %s" % (
+            record["depth"], record["seldepth"], formatScore(record["score"]), record["nodes"],
+            record["nodes"] / record["time"] if record["time"] > 0 else 0, record["time"] * 1000,
+            " ".join(record["pv"])))
+
+    def stopSearch(self):
+        """
+        Stop a running search and wait for it to print its bestmove
+        :return:
+        """
+        if self.search is not None:
+            self.release.set()
+            self.search.cancel()
+            self.search = None
+
+
+def findMove(gs, notation):
+    """
+    The legal move of gs written as notation in coordinate form, e.g. e2e4 or e7e8q
+    :param gs:
+    :param notation:
+    :return: the Move, or None when there is no such legal move
+    """
+    for move in gs.getValidMoves():
+        if move.getChessNotation() == notation:
+            return move
+    return None
+
+
+def formatScore(score):
+    """
+    A search score as UCI writes it: mate in moves, negative when the engine gets mated, or centipawns
+    :param score: from the side to move's point of view
+    :return: e.g. "cp 35" or "mate -2"
+    """
+    moves = SmartMoveFinder.mateMoves(score)
+    if moves is None:
+        return "cp %d" % score
+    return "mate %d" % moves
+
+
+def allocateTime(clock, increment=0, movesToGo=None):
+    """
+    Seconds to spend on this move out of the remaining clock time
+    :param clock: seconds left
+    :param increment: seconds added per move
+    :param movesToGo: moves until the next time control, None for sudden death
+    :return:
+    """
+    budget = clock / (movesToGo or DEFAULT_MOVES_TO_GO) + increment - MOVE_OVERHEAD
+    # never more than the clock can pay for, at 0 the search plays the first root move it scores
+    return max(0, min(max(budget, MIN_MOVE_TIME), clock / 2, clock - MOVE_OVERHEAD))
+
+
+def main(inputStream=sys.stdin, out=sys.stdout):
+    session = UciSession(out)
+    for line in inputStream:
+        if not session.handle(line):
+            break
+    session.stopSearch()
+    session.closeBook()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())